@@ -1,13 +1,36 @@
 import json
 import os
+import hashlib
+import hmac
+import base64
+import itertools
 import time
 import logging
+import threading
+import functools
 import requests
-from flask import Flask, request, Response, jsonify, redirect
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import DefaultCookiePolicy
+from collections import OrderedDict, namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import MappingProxyType
+from flask import Flask, request, Response, jsonify, redirect, g
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 from urllib.parse import urlparse, urljoin, quote, unquote
 import unicodedata
+import codecs
 import re
+import tempfile
+from contextlib import contextmanager
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Non disponibile su Windows: niente coordinamento tra processi
+    fcntl = None
 
 # Configurazione del logging
 logging.basicConfig(
@@ -24,8 +47,8 @@ CORS(app)  # Abilita CORS per tutti gli endpoint
 ADDON_NAME = "Vavoo.to Italy"
 ADDON_ID = "com.stremio.vavoo.italy"
 ADDON_VERSION = "1.1.0"
-VAVOO_API_URL = "https://vavoo.to/channels"
-VAVOO_STREAM_BASE_URL = "https://vavoo.to/play/{id}/index.m3u8"
+VAVOO_API_URL = os.environ.get('VAVOO_API_URL', "https://vavoo.to/channels")
+VAVOO_STREAM_BASE_URL = os.environ.get('VAVOO_STREAM_BASE_URL', "https://vavoo.to/play/{id}/index.m3u8")
 ID_PREFIX = "vavoo_"  # Prefisso per gli ID dei contenuti
 
 # Configurazione del proxy
@@ -35,6 +58,15 @@ DEFAULT_HEADERS = {
     "Origin": "https://vavoo.to"
 }
 
+# Avvio: con preload_app di gunicorn i dati vengono preparati nel master prima del fork (warm_up)
+startup_state = {
+    "started_at": time.time(),
+    "warm_up_pid": None,
+    "warm_up_seconds": None,
+    "ready_at": 0
+}
+WARM_UP_CATALOG_PAGES = int(os.environ.get('WARM_UP_CATALOG_PAGES', 3))  # pagine del catalogo pre-serializzate
+
 # Cache dei canali
 channels_cache = []
 cache_timestamp = 0
@@ -42,6 +74,1036 @@ CACHE_DURATION = 600  # 10 minuti
 CACHE_LOGOS = {}  # Cache per i loghi
 CACHE_LOGOS_TIMESTAMP = 0
 
+# Refresh in background della lista canali (si continua a servire la copia precedente)
+CHANNELS_REFRESH_AHEAD = int(os.environ.get('CHANNELS_REFRESH_AHEAD', 60))  # secondi prima della scadenza
+CHANNELS_REFRESH_BACKOFF_BASE = int(os.environ.get('CHANNELS_REFRESH_BACKOFF_BASE', 5))  # secondi
+CHANNELS_REFRESH_BACKOFF_MAX = int(os.environ.get('CHANNELS_REFRESH_BACKOFF_MAX', 300))  # secondi
+CHANNELS_COLD_START_WAIT = 30  # Attesa massima di un refresh altrui quando non ci sono canali da servire
+
+# Directory condivisa dai worker dello stesso nodo (snapshot dei canali e lock del refresh)
+SHARED_STATE_DIR = os.environ.get('SHARED_STATE_DIR', os.path.join(tempfile.gettempdir(), 'vavoo-addon'))
+CHANNELS_SNAPSHOT_PATH = os.path.join(SHARED_STATE_DIR, 'channels-snapshot.json')
+CHANNELS_SNAPSHOT_LOCK_PATH = os.path.join(SHARED_STATE_DIR, 'channels-snapshot.lock')
+CHANNELS_SNAPSHOT_FORMAT = 1
+
+# Configurazione del pool di connessioni keep-alive verso vavoo.to e le CDN
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 16))  # host con un pool dedicato
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 32))  # connessioni riutilizzabili per host
+UPSTREAM_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', 'False').lower() == 'true'
+UPSTREAM_KEEPALIVE = os.environ.get('UPSTREAM_KEEPALIVE', 'True').lower() == 'true'
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))
+UPSTREAM_RETRY_BACKOFF = float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.2))
+
+# Sessione condivisa dai thread del worker (ricreata dopo un fork)
+upstream_session = None
+upstream_session_pid = None
+upstream_session_lock = threading.Lock()
+
+def get_upstream_session():
+    """
+    Restituisce la sessione HTTP condivisa con un pool di connessioni per host
+    """
+    global upstream_session, upstream_session_pid
+    pid = os.getpid()
+    if upstream_session is not None and upstream_session_pid == pid:
+        return upstream_session
+
+    with upstream_session_lock:
+        if upstream_session is None or upstream_session_pid != pid:
+            retry = Retry(
+                total=UPSTREAM_RETRIES,
+                read=0,  # Non ripetiamo le richieste già avviate: i byte potrebbero essere già stati inoltrati
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                backoff_factor=UPSTREAM_RETRY_BACKOFF,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=UPSTREAM_POOL_CONNECTIONS,
+                pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+                pool_block=UPSTREAM_POOL_BLOCK,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # Come con requests.get, i cookie non vengono conservati tra una richiesta e l'altra
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            if not UPSTREAM_KEEPALIVE:
+                session.headers["Connection"] = "close"
+            upstream_session = session
+            upstream_session_pid = pid
+            logger.info(f"Pool connessioni upstream inizializzato (maxsize={UPSTREAM_POOL_MAXSIZE} per host)")
+    return upstream_session
+
+def upstream_get(url, **kwargs):
+    """Esegue una GET upstream riutilizzando le connessioni del pool"""
+    return get_upstream_session().get(url, **kwargs)
+
+def upstream_pool_stats():
+    """
+    Statistiche di saturazione del pool: connessioni in uso, inattive e create per host
+    """
+    session = upstream_session
+    if session is None or upstream_session_pid != os.getpid():
+        return {}
+
+    stats = {}
+    adapter = session.get_adapter("https://")
+    pools = adapter.poolmanager.pools
+    for pool_key in pools.keys():
+        pool = pools.get(pool_key)
+        if pool is None or pool.pool is None:
+            continue
+        free_slots = pool.pool.qsize()
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        in_use = max(pool.pool.maxsize - free_slots, 0)
+        stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+            "in_use": in_use,
+            "idle": idle,
+            "maxsize": pool.pool.maxsize,
+            "saturation": round(in_use / pool.pool.maxsize, 4) if pool.pool.maxsize else 0,
+            "connections_created": pool.num_connections,
+            "requests": pool.num_requests
+        }
+    return stats
+
+# Metriche Prometheus (/metrics), aggregate tra i worker del nodo tramite file in SHARED_STATE_DIR
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_DIR = os.path.join(SHARED_STATE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # secondi
+
+# Etichetta "route" delle metriche per gli endpoint Flask
+METRICS_ROUTES = {
+    "catalog": "catalog",
+    "catalog_with_extra": "catalog",
+    "meta": "meta",
+    "stream": "stream",
+    "proxy_m3u": "proxy_m3u",
+    "proxy_ts": "proxy_ts",
+    "manifest_json": "manifest",
+    "status": "status",
+    "ready": "ready"
+}
+
+metrics_registry = metrics.MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+metrics_registry.define("vavoo_http_request_duration_seconds", metrics.HISTOGRAM, "Durata delle richieste, fino all'invio dell'ultimo byte")
+metrics_registry.define("vavoo_http_requests_total", metrics.COUNTER, "Richieste servite per route e codice di stato")
+metrics_registry.define("vavoo_http_requests_in_flight", metrics.GAUGE, "Richieste in corso")
+metrics_registry.define("vavoo_proxied_bytes_total", metrics.COUNTER, "Byte inviati ai client dagli endpoint proxy")
+metrics_registry.define("vavoo_upstream_ttfb_seconds", metrics.HISTOGRAM, "Tempo fino agli header della risposta upstream")
+metrics_registry.define("vavoo_upstream_duration_seconds", metrics.HISTOGRAM, "Durata totale dei download upstream")
+metrics_registry.define("vavoo_upstream_bytes_total", metrics.COUNTER, "Byte scaricati dall'upstream")
+metrics_registry.define("vavoo_upstream_errors_total", metrics.COUNTER, "Download upstream falliti")
+metrics_registry.define("vavoo_upstream_in_flight", metrics.GAUGE, "Download upstream in corso")
+metrics_registry.define("vavoo_cache_hits_total", metrics.COUNTER, "Letture servite dalla cache")
+metrics_registry.define("vavoo_cache_misses_total", metrics.COUNTER, "Letture non trovate in cache")
+metrics_registry.define("vavoo_cache_evictions_total", metrics.COUNTER, "Voci eliminate per fare spazio")
+metrics_registry.define("vavoo_cache_bytes", metrics.GAUGE, "Byte occupati dalla cache")
+metrics_registry.define("vavoo_admission_active", metrics.GAUGE, "Richieste ammesse in corso per classe di traffico")
+metrics_registry.define("vavoo_admission_waiting", metrics.GAUGE, "Richieste in coda di ammissione per classe di traffico")
+metrics_registry.define("vavoo_admission_rejected_total", metrics.COUNTER, "Richieste rifiutate con 503 per coda piena o attesa scaduta")
+metrics_registry.define("vavoo_admission_limit", metrics.GAUGE, "Limite di concorrenza corrente per classe di traffico")
+metrics_registry.define("vavoo_disk_cache_bytes", metrics.GAUGE, "Byte occupati dalla cache dei segmenti su disco (condivisa dai worker)", shared=True)
+
+def record_upstream(url, ttfb, duration, size, ok):
+    """Registra tempi, byte ed esito di un download upstream"""
+    if not METRICS_ENABLED:
+        return
+    labels = (("host", urlparse(url).netloc),)
+    if ttfb is not None:
+        metrics_registry.observe("vavoo_upstream_ttfb_seconds", labels, ttfb)
+    metrics_registry.observe("vavoo_upstream_duration_seconds", labels, duration)
+    if size:
+        metrics_registry.inc("vavoo_upstream_bytes_total", labels, size)
+    if not ok:
+        metrics_registry.inc("vavoo_upstream_errors_total", labels)
+
+# Controllo di ammissione: budget separati per il traffico proxy e per quello di metadati,
+# così catalogo, meta e stream restano veloci anche quando lo streaming satura i thread.
+# Disattivato di default: un 503 su un segmento interrompe la riproduzione nei player HLS
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'False').lower() == 'true'
+ADMISSION_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))  # thread gthread per worker
+ADMISSION_PROXY_LIMIT = int(os.environ.get('ADMISSION_PROXY_LIMIT', ADMISSION_THREADS))
+# Coda ampia: allo scadere di un segmento tutti gli spettatori di un canale lo richiedono insieme
+ADMISSION_PROXY_QUEUE = int(os.environ.get('ADMISSION_PROXY_QUEUE', ADMISSION_THREADS * 4))
+ADMISSION_METADATA_LIMIT = int(os.environ.get('ADMISSION_METADATA_LIMIT', ADMISSION_THREADS))
+ADMISSION_METADATA_QUEUE = int(os.environ.get('ADMISSION_METADATA_QUEUE', ADMISSION_THREADS))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))  # secondi di attesa massima in coda
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))  # secondi suggeriti ai client rifiutati
+# Limite proxy adattivo: si riduce quando il TTFB upstream recente supera di ADMISSION_LATENCY_TOLERANCE volte quello abituale
+ADMISSION_ADAPTIVE = os.environ.get('ADMISSION_ADAPTIVE', 'False').lower() == 'true'
+ADMISSION_LATENCY_TOLERANCE = float(os.environ.get('ADMISSION_LATENCY_TOLERANCE', 2))
+ADMISSION_ADAPT_INTERVAL = 1  # secondi tra due aggiustamenti del limite
+ADMISSION_EXEMPT_ENDPOINTS = {"status", "ready", "prometheus_metrics"}  # osservabilità sempre disponibile
+
+class AdaptiveLimit:
+    """
+    Limite di concorrenza AIMD guidato dalla latenza upstream: se la media recente del TTFB
+    supera di `tolerance` volte la media di lungo periodo il limite scende del 10%,
+    altrimenti risale di uno alla volta fino al massimo configurato
+    """
+    def __init__(self, max_limit, adaptive, tolerance, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.value = max_limit
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.short_latency = None  # media mobile veloce
+        self.long_latency = None  # media mobile lenta (latenza abituale)
+        self.last_adjustment = 0
+        self.decreases = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Registra un TTFB upstream; restituisce True se il limite è aumentato"""
+        if not self.adaptive or seconds is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self.short_latency is None:
+                self.short_latency = self.long_latency = seconds
+            self.short_latency += 0.2 * (seconds - self.short_latency)
+            self.long_latency += 0.01 * (seconds - self.long_latency)
+            if now - self.last_adjustment < ADMISSION_ADAPT_INTERVAL:
+                return False
+            self.last_adjustment = now
+            if self.short_latency > self.long_latency * self.tolerance:
+                new_value = max(int(self.value * 0.9), self.min_limit)
+                if new_value < self.value:
+                    self.decreases += 1
+                self.value = new_value
+                return False
+            if self.value < self.max_limit:
+                self.value += 1
+                return True
+        return False
+
+    def stats(self):
+        return {
+            "adaptive": self.adaptive,
+            "max_limit": self.max_limit,
+            "limit": self.value,
+            "decreases": self.decreases,
+            "short_latency": round(self.short_latency, 4) if self.short_latency is not None else None,
+            "long_latency": round(self.long_latency, 4) if self.long_latency is not None else None
+        }
+
+class AdmissionLimiter:
+    """
+    Limitatore di concorrenza con coda di attesa limitata: oltre il limite le richieste
+    attendono al più `queue_timeout` secondi; a coda piena vengono rifiutate subito
+    """
+    def __init__(self, name, limit, queue_size, queue_timeout):
+        self.name = name
+        self.limit = limit  # AdaptiveLimit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Restituisce True se la richiesta può procedere (da chiudere con release)"""
+        with self._cond:
+            if self.active < self.limit.value and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.limit.value:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def observe_latency(self, seconds):
+        if self.limit.observe(seconds):
+            with self._cond:
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                "active": self.active,
+                "waiting": self.waiting,
+                "queue_size": self.queue_size,
+                "queue_timeout": self.queue_timeout,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out
+            }
+        stats.update(self.limit.stats())
+        return stats
+
+proxy_admission = AdmissionLimiter("proxy", AdaptiveLimit(ADMISSION_PROXY_LIMIT, ADMISSION_ADAPTIVE, ADMISSION_LATENCY_TOLERANCE),
+                                   ADMISSION_PROXY_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+metadata_admission = AdmissionLimiter("metadata", AdaptiveLimit(ADMISSION_METADATA_LIMIT, False, ADMISSION_LATENCY_TOLERANCE),
+                                      ADMISSION_METADATA_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+
+# Configurazione della cache delle risposte JSON di catalogo e meta
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 60))  # secondi, header Cache-Control
+
+# Regole per l'assegnazione dei generi ai canali
+GENRE_RULES_FILE = 'generi_canali.json'
+GENRE_CACHE_SIZE = 4096  # Nomi di canale di cui ricordare il genere
+
+# Configurazione della ricerca nel catalogo
+SEARCH_PREFIX_RANKING = os.environ.get('SEARCH_PREFIX_RANKING', 'False').lower() == 'true'  # prima i nomi che iniziano con la query
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 256))  # query recenti memorizzate per indice
+
+# Configurazione della cache dei segmenti TS (condivisa tra i thread del worker)
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+SEGMENT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_ENTRY_BYTES', 16 * 1024 * 1024))
+SEGMENT_CACHE_DEFAULT_TTL = int(os.environ.get('SEGMENT_CACHE_DEFAULT_TTL', 30))  # secondi, se la playlist non è nota
+SEGMENT_CACHE_TTL_MULTIPLIER = int(os.environ.get('SEGMENT_CACHE_TTL_MULTIPLIER', 3))  # multipli di #EXT-X-TARGETDURATION
+# Secondo livello della cache dei segmenti su disco locale, condiviso dai worker del nodo (0 = disattivato)
+SEGMENT_DISK_CACHE_DIR = os.environ.get('SEGMENT_DISK_CACHE_DIR', os.path.join(SHARED_STATE_DIR, 'segments'))
+SEGMENT_DISK_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_DISK_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+SEGMENT_DISK_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('SEGMENT_DISK_CACHE_MAX_ENTRY_BYTES', 32 * 1024 * 1024))
+SEGMENT_DISK_CACHE_SCAN_INTERVAL = 10  # secondi tra due ricalcoli dell'occupazione (anche degli altri worker)
+SEGMENT_DISK_CACHE_TMP_MAX_AGE = 300  # secondi dopo i quali un file temporaneo è considerato orfano
+TARGET_DURATION_HINTS_MAX = 1024  # Numero massimo di playlist di cui ricordare la target duration
+
+class ByteLRUCache:
+    """
+    Cache LRU thread-safe limitata dalla dimensione totale in byte, con scadenza per voce
+    """
+    def __init__(self, name, max_bytes, max_entry_bytes=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes
+        self._entries = OrderedDict()  # chiave -> (valore, dimensione, scadenza)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key):
+        """Verifica la presenza di una voce valida senza aggiornare LRU e contatori"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[2] > time.monotonic()
+
+    def put(self, key, value, ttl, size=None):
+        size = len(value) if size is None else size
+        if ttl <= 0 or size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            # Evizione LRU finché non rientriamo nel limite di byte
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def keys(self):
+        """Copia delle chiavi presenti (anche scadute), dalla meno alla più usata"""
+        with self._lock:
+            return list(self._entries)
+
+    def discard(self, key):
+        """Elimina una voce, se presente"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[1]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+segment_cache = ByteLRUCache("segments", SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_MAX_ENTRY_BYTES)
+
+class DiskSegmentCache:
+    """
+    Cache dei segmenti su disco: un file per segmento, scritto in modo atomico (file temporaneo + rename)
+    e con la scadenza salvata come mtime. I file vengono serviti con sendfile senza passare dalla memoria
+    del processo. Quando si supera il limite di byte si eliminano prima i segmenti che scadono prima.
+    """
+    TMP_PREFIX = ".tmp-"
+
+    def __init__(self, directory, max_bytes, max_entry_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._bytes = 0  # stima dell'occupazione, ricalcolata periodicamente dalla scansione
+        self._last_scan = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+        # All'avvio: eliminiamo file temporanei orfani e segmenti scaduti
+        self.scan(cleanup_tmp=True)
+
+    def path_for(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".ts")
+
+    def open(self, key):
+        """Apre il segmento in cache: restituisce (file, dimensione) oppure None"""
+        path = self.path_for(key)
+        try:
+            segment_file = open(path, "rb")
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"Lettura della cache dei segmenti su disco fallita: {str(e)}")
+            return None
+        # Il descrittore resta valido anche se un altro worker elimina il file
+        stat = os.fstat(segment_file.fileno())
+        if stat.st_mtime <= time.time():
+            segment_file.close()
+            self._remove(path, stat.st_size)
+            self._count("expirations", "misses")
+            return None
+        self._count("hits")
+        return segment_file, stat.st_size
+
+    def get_path(self, key):
+        """Percorso del segmento in cache se presente e non scaduto"""
+        cached = self.open(key)
+        if cached is None:
+            return None
+        cached[0].close()
+        return self.path_for(key)
+
+    def contains(self, key):
+        """Verifica la presenza di un segmento valido senza aggiornare i contatori"""
+        try:
+            return os.stat(self.path_for(key)).st_mtime > time.time()
+        except OSError:
+            return False
+
+    def put(self, key, chunks, size, ttl):
+        if ttl <= 0 or size > self.max_entry_bytes:
+            return False
+        path = self.path_for(key)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=self.TMP_PREFIX)
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    tmp_file.writelines(chunks)
+                os.chmod(tmp_path, 0o644)
+                expires_at = time.time() + ttl
+                os.utime(tmp_path, (expires_at, expires_at))
+                # Il rename è atomico: chi legge vede il segmento completo o nessun segmento
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"Scrittura della cache dei segmenti su disco fallita: {str(e)}")
+            return False
+        with self._lock:
+            self.writes += 1
+            self._bytes += size
+            needs_scan = self._bytes > self.max_bytes or time.monotonic() - self._last_scan > SEGMENT_DISK_CACHE_SCAN_INTERVAL
+        if needs_scan:
+            self.scan()
+        return True
+
+    def _count(self, *names):
+        """Incrementa i contatori indicati (aggiornati da più thread)"""
+        with self._lock:
+            for name in names:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def _remove(self, path, size):
+        try:
+            os.unlink(path)
+        except OSError:
+            return False
+        with self._lock:
+            self._bytes = max(self._bytes - size, 0)
+        return True
+
+    def scan(self, cleanup_tmp=False):
+        """Ricalcola l'occupazione, elimina i segmenti scaduti e applica il limite di byte"""
+        with self._lock:
+            self._last_scan = time.monotonic()
+        now = time.time()
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as iterator:
+                for entry in iterator:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.startswith(self.TMP_PREFIX):
+                        # I temporanei recenti possono essere scritture in corso di altri worker
+                        if cleanup_tmp and now - stat.st_mtime > SEGMENT_DISK_CACHE_TMP_MAX_AGE:
+                            self._remove(entry.path, 0)
+                        continue
+                    if stat.st_mtime <= now:
+                        if self._remove(entry.path, 0):
+                            self._count("expirations")
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"Scansione della cache dei segmenti su disco fallita: {str(e)}")
+            return
+        if total > self.max_bytes:
+            # Scendiamo al 90% del limite per non ripetere la scansione a ogni scrittura
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                if self._remove(path, 0):
+                    self._count("evictions")
+                total -= size
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "directory": self.directory,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "errors": self.errors
+            }
+
+def create_disk_segment_cache():
+    """Crea il livello su disco della cache dei segmenti, se attivo e se la directory è utilizzabile"""
+    if SEGMENT_DISK_CACHE_MAX_BYTES <= 0:
+        return None
+    try:
+        return DiskSegmentCache(SEGMENT_DISK_CACHE_DIR, SEGMENT_DISK_CACHE_MAX_BYTES, SEGMENT_DISK_CACHE_MAX_ENTRY_BYTES)
+    except OSError as e:
+        logger.warning(f"Cache dei segmenti su disco disattivata: {str(e)}")
+        return None
+
+segment_disk_cache = create_disk_segment_cache()
+
+def segment_cached(cache_key):
+    """Verifica se il segmento è già in uno dei due livelli di cache"""
+    if segment_cache.contains(cache_key):
+        return True
+    return segment_disk_cache is not None and segment_disk_cache.contains(cache_key)
+
+# Configurazione della cache delle playlist riscritte
+PLAYLIST_CACHE_MAX_BYTES = int(os.environ.get('PLAYLIST_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+PLAYLIST_CACHE_LIVE_FACTOR = float(os.environ.get('PLAYLIST_CACHE_LIVE_FACTOR', 0.5))  # frazione di #EXT-X-TARGETDURATION
+PLAYLIST_CACHE_LIVE_DEFAULT_TTL = 2  # secondi, playlist live senza target duration
+PLAYLIST_CACHE_VOD_TTL = int(os.environ.get('PLAYLIST_CACHE_VOD_TTL', 3600))  # playlist VOD o con #EXT-X-ENDLIST
+PLAYLIST_CACHE_STATIC_TTL = int(os.environ.get('PLAYLIST_CACHE_STATIC_TTL', 300))  # master playlist e liste M3U
+
+playlist_cache = ByteLRUCache("playlists", PLAYLIST_CACHE_MAX_BYTES)
+
+# Prefetch dei segmenti più recenti delle playlist live (opzionale)
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'False').lower() == 'true'
+PREFETCH_SEGMENTS = int(os.environ.get('PREFETCH_SEGMENTS', 2))  # ultimi N segmenti della playlist
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))  # thread dedicati al prefetch
+PREFETCH_MAX_PENDING = int(os.environ.get('PREFETCH_MAX_PENDING', 32))  # prefetch in coda o in corso
+PREFETCH_CHANNEL_BUDGET = int(os.environ.get('PREFETCH_CHANNEL_BUDGET', 2))  # prefetch contemporanei per canale
+PREFETCH_MIN_VIEWERS = int(os.environ.get('PREFETCH_MIN_VIEWERS', 1))
+PREFETCH_VIEWER_WINDOW = int(os.environ.get('PREFETCH_VIEWER_WINDOW', 30))  # secondi
+PREFETCH_MAX_CHANNELS = 1024  # Canali di cui tracciare gli spettatori
+
+playlist_viewers = OrderedDict()  # chiave playlist -> {spettatore: ultima richiesta}
+prefetch_inflight = {}  # chiave playlist -> prefetch in corso
+prefetch_pending = [0]
+prefetch_lock = threading.Lock()
+prefetch_executor = None
+prefetch_executor_pid = None
+prefetch_stats = {  # aggiornato sotto prefetch_lock
+    "scheduled": 0,
+    "completed": 0,
+    "failed": 0,
+    "skipped_cached": 0,
+    "skipped_budget": 0,
+    "skipped_inactive": 0
+}
+
+def count_prefetch(name):
+    with prefetch_lock:
+        prefetch_stats[name] += 1
+
+# Target duration (#EXT-X-TARGETDURATION) delle playlist viste, per directory dei segmenti
+target_duration_hints = OrderedDict()
+target_duration_lock = threading.Lock()
+
+# Protezione dalle code di latenza e dai guasti degli host upstream
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))  # errori consecutivi per aprire il circuito
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 15))  # rifiuto immediato prima di un nuovo tentativo
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'True').lower() == 'true'
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 0.9))  # percentile del TTFB oltre il quale si duplica la richiesta
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 0.25))  # secondi
+HEDGE_MAX_DELAY = float(os.environ.get('HEDGE_MAX_DELAY', 3))  # secondi
+HEDGE_BUDGET = float(os.environ.get('HEDGE_BUDGET', 0.1))  # frazione massima di richieste duplicate
+HEDGE_MIN_SAMPLES = 20  # TTFB da osservare per host prima di duplicare
+HEDGE_SAMPLES = 200  # TTFB recenti conservati per host
+
+class CircuitOpenError(requests.ConnectionError):
+    """Richiesta rifiutata senza contattare l'host perché il circuito è aperto"""
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuito aperto per {host}, nuovo tentativo tra {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Circuit breaker per host: dopo CIRCUIT_FAILURE_THRESHOLD errori consecutivi le richieste vengono
+    rifiutate subito per CIRCUIT_OPEN_SECONDS; poi passa una sola richiesta di prova (half-open)
+    """
+    def __init__(self, failure_threshold, open_seconds):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {
+                "state": "closed",
+                "consecutive_failures": 0,
+                "open_until": 0,
+                "probe_in_flight": False,
+                "opened": 0,
+                "rejected": 0
+            }
+        return state
+
+    def before_request(self, host):
+        """Solleva CircuitOpenError se l'host va evitato"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(host)
+            if state["state"] == "closed":
+                return
+            if state["state"] == "open" and now >= state["open_until"]:
+                state["state"] = "half_open"
+            if state["state"] == "half_open" and not state["probe_in_flight"]:
+                state["probe_in_flight"] = True
+                return
+            state["rejected"] += 1
+            retry_after = max(state["open_until"] - now, 1)
+        raise CircuitOpenError(host, retry_after)
+
+    def record(self, host, ok):
+        with self._lock:
+            state = self._state(host)
+            state["probe_in_flight"] = False
+            if ok:
+                state["state"] = "closed"
+                state["consecutive_failures"] = 0
+                return
+            state["consecutive_failures"] += 1
+            if state["state"] == "half_open" or state["consecutive_failures"] >= self.failure_threshold:
+                if state["state"] != "open":
+                    logger.warning(f"Circuito aperto per {host} dopo {state['consecutive_failures']} errori consecutivi")
+                    state["opened"] += 1
+                state["state"] = "open"
+                state["open_until"] = time.monotonic() + self.open_seconds
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    "state": state["state"],
+                    "consecutive_failures": state["consecutive_failures"],
+                    "open_for_seconds": round(max(state["open_until"] - now, 0), 1) if state["state"] == "open" else 0,
+                    "opened": state["opened"],
+                    "rejected": state["rejected"]
+                }
+                for host, state in self._hosts.items()
+            }
+
+circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+
+class HedgePolicy:
+    """
+    Richieste duplicate (hedging): se l'header della risposta non arriva entro il percentile
+    HEDGE_PERCENTILE del TTFB osservato per l'host, si avvia una seconda richiesta identica
+    e si usa quella che risponde per prima, entro un budget di richieste duplicate
+    """
+    def __init__(self, percentile, min_delay, max_delay, budget):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._samples = {}  # host -> TTFB recenti
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, host, ttfb):
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None:
+                samples = self._samples[host] = deque(maxlen=HEDGE_SAMPLES)
+            samples.append(ttfb)
+
+    def delay(self, host):
+        """Attesa prima della richiesta duplicata, None se non c'è abbastanza storia per l'host"""
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None or len(samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        value = ordered[min(int(self.percentile * len(ordered)), len(ordered) - 1)]
+        return min(max(value, self.min_delay), self.max_delay)
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def allow_hedge(self):
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        hosts = list(self._samples)
+        return {
+            "enabled": HEDGE_ENABLED,
+            "percentile": self.percentile,
+            "min_delay": self.min_delay,
+            "max_delay": self.max_delay,
+            "budget": self.budget,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "delay_by_host": {host: self.delay(host) for host in hosts}
+        }
+
+hedge_policy = HedgePolicy(HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY, HEDGE_BUDGET)
+hedge_executor = None
+hedge_executor_pid = None
+hedge_executor_lock = threading.Lock()
+
+def get_hedge_executor():
+    """Pool di thread per le richieste con hedging (uno per processo, ricreato dopo un fork)"""
+    global hedge_executor, hedge_executor_pid
+    pid = os.getpid()
+    if hedge_executor is None or hedge_executor_pid != pid:
+        with hedge_executor_lock:
+            if hedge_executor is None or hedge_executor_pid != pid:
+                hedge_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_MAXSIZE * 2, thread_name_prefix="hedge")
+                hedge_executor_pid = pid
+    return hedge_executor
+
+def close_response_when_done(future):
+    """Chiude la risposta di una richiesta duplicata che ha perso la gara"""
+    def close(done_future):
+        if done_future.exception() is None:
+            done_future.result().close()
+    future.add_done_callback(close)
+
+def open_upstream(url, headers, timeout, hedge=False):
+    """
+    Avvia una GET upstream in streaming rispettando il circuit breaker dell'host e,
+    per le richieste con hedge=True, duplicandola se il primo byte tarda
+    """
+    host = urlparse(url).netloc
+    circuit_breaker.before_request(host)
+    delay = hedge_policy.delay(host) if hedge and HEDGE_ENABLED else None
+    if delay is not None:
+        # Il budget si calcola solo sulle richieste per cui una duplicata può davvero partire
+        hedge_policy.start_request()
+    started = time.perf_counter()
+    kwargs = dict(headers=headers, stream=True, allow_redirects=True, timeout=timeout)
+    try:
+        if delay is None:
+            response = upstream_get(url, **kwargs)
+        else:
+            executor = get_hedge_executor()
+            primary = executor.submit(upstream_get, url, **kwargs)
+            done, _ = wait([primary], timeout=delay)
+            if done or not hedge_policy.allow_hedge():
+                response = primary.result()
+            else:
+                response = race_hedged_requests(primary, executor.submit(upstream_get, url, **kwargs))
+    except Exception:
+        circuit_breaker.record(host, False)
+        raise
+    if response.status_code < 500:
+        hedge_policy.observe(host, time.perf_counter() - started)
+    return response
+
+def race_hedged_requests(primary, hedged):
+    """Restituisce la prima risposta arrivata tra richiesta originale e duplicata"""
+    pending = {primary, hedged}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            for loser in pending:
+                close_response_when_done(loser)
+            if future is hedged:
+                hedge_policy.record_win()
+            return future.result()
+    raise error
+
+# Dimensione dei chunk letti dall'upstream nei download condivisi
+UPSTREAM_CHUNK_SIZE = 64 * 1024
+# I chunk raddoppiano fino a questo limite: i primi byte partono subito, il resto con poche letture grandi
+UPSTREAM_MAX_CHUNK_SIZE = int(os.environ.get('UPSTREAM_MAX_CHUNK_SIZE', 1024 * 1024))
+
+def response_content_length(headers):
+    """Content-Length dell'upstream, se corrisponde ai byte inoltrati (nessuna Content-Encoding)"""
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    try:
+        length = int(headers.get('Content-Length', ''))
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+def requests_exception(error):
+    """Eccezione di requests equivalente a un errore di urllib3 durante la lettura del corpo"""
+    if isinstance(error, urllib3.exceptions.ReadTimeoutError):
+        return requests.exceptions.ReadTimeout(error)
+    if isinstance(error, urllib3.exceptions.DecodeError):
+        return requests.exceptions.ContentDecodingError(error)
+    return requests.exceptions.ConnectionError(error)
+
+class UpstreamFetch:
+    """
+    Download upstream condiviso: una sola richiesta, più lettori che ricevono i byte man mano che arrivano
+    """
+    def __init__(self, key, url, headers, timeout, on_complete=None, hedge=False):
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.on_complete = on_complete  # Può restituire una funzione da eseguire dopo aver svegliato i lettori
+        self.hedge = hedge  # Richiesta duplicata se il primo byte tarda
+        self.final_url = url
+        self.encoding = None
+        self.content_length = None  # Dimensione annunciata dall'upstream, se nota
+        self.result = None  # Valore calcolato da on_complete, condiviso con chi attende
+        self.chunks = []
+        self.size = 0
+        self.headers_ready = False
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def run(self):
+        """Esegue il download (in un thread dedicato, indipendente dai client)"""
+        started = time.perf_counter()
+        ttfb = None
+        host = urlparse(self.url).netloc
+        response = None
+        try:
+            response = open_upstream(self.url, self.headers, self.timeout, self.hedge)
+            ttfb = time.perf_counter() - started
+            proxy_admission.observe_latency(ttfb)
+            try:
+                response.raise_for_status()
+                with self._cond:
+                    self.final_url = response.url
+                    self.encoding = response.encoding
+                    self.content_length = response_content_length(response.headers)
+                    self.headers_ready = True
+                    self._cond.notify_all()
+                chunk_size = UPSTREAM_CHUNK_SIZE
+                while not response.raw.closed:
+                    chunk = response.raw.read(chunk_size, decode_content=True)
+                    if not chunk:
+                        continue
+                    with self._cond:
+                        self.chunks.append(chunk)
+                        self.size += len(chunk)
+                        self._cond.notify_all()
+                    if len(chunk) >= chunk_size and chunk_size < UPSTREAM_MAX_CHUNK_SIZE:
+                        chunk_size = min(chunk_size * 2, UPSTREAM_MAX_CHUNK_SIZE)
+                # Una risposta più corta del Content-Length annunciato è troncata e non va messa in cache
+                if self.content_length is not None and self.size != self.content_length:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Risposta troncata: ricevuti {self.size} byte su {self.content_length}")
+            finally:
+                response.close()
+        except urllib3.exceptions.HTTPError as e:
+            # response.raw.read non converte le eccezioni di urllib3 come fa iter_content
+            with self._cond:
+                self.error = requests_exception(e)
+        except Exception as e:
+            with self._cond:
+                self.error = e
+        if response is not None:
+            # Gli errori 4xx dipendono dalla richiesta, non dalla salute dell'host
+            circuit_breaker.record(host, response.status_code < 500 and (self.error is None or isinstance(self.error, requests.HTTPError)))
+        record_upstream(self.url, ttfb, time.perf_counter() - started, self.size, self.error is None)
+        persist = None
+        try:
+            # Elaborazione del contenuto completo (es. inserimento in cache) prima di svegliare chi attende
+            if self.error is None and self.on_complete:
+                persist = self.on_complete(self)
+        except Exception as e:
+            logger.error(f"Errore nel completamento del download di {self.url}: {str(e)}")
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+        # Le operazioni lente restituite da on_complete (es. scrittura su disco) non fanno attendere i lettori
+        run_persist(persist, self.url)
+        # Rimuoviamo il download dal registro solo dopo l'eventuale inserimento in cache
+        with inflight_lock:
+            if inflight_fetches.get(self.key) is self:
+                del inflight_fetches[self.key]
+
+    def wait_headers(self):
+        """Attende la risposta upstream; rilancia l'eccezione se la richiesta è fallita"""
+        with self._cond:
+            while not self.headers_ready and not self.done:
+                self._cond.wait()
+            if not self.headers_ready:
+                raise self.error
+
+    def iter_chunks(self):
+        """Restituisce i chunk già ricevuti e poi quelli in arrivo, fino alla fine del download"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                new_chunks = self.chunks[index:]
+                index += len(new_chunks)
+                finished = self.done and index >= len(self.chunks)
+                error = self.error
+            for chunk in new_chunks:
+                yield chunk
+            if finished:
+                if error is not None:
+                    logger.error(f"Download interrotto per {self.url}: {str(error)}")
+                return
+
+    def read_all(self):
+        """Attende la fine del download e restituisce il contenuto completo"""
+        self.wait_headers()
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+            return b"".join(self.chunks)
+
+def run_persist(persist, url):
+    """Esegue la funzione restituita da on_complete, se presente, dopo il completamento del download"""
+    if persist is None:
+        return
+    try:
+        persist()
+    except Exception as e:
+        logger.error(f"Errore nel salvataggio del download di {url}: {str(e)}")
+
+# Download upstream in corso, condivisi tra le richieste concorrenti per lo stesso URL
+inflight_fetches = {}
+inflight_lock = threading.Lock()
+
+def get_shared_fetch(key, url, headers, timeout, on_complete=None, hedge=False):
+    """
+    Restituisce il download in corso per la chiave o ne avvia uno nuovo
+    """
+    with inflight_lock:
+        fetch = inflight_fetches.get(key)
+        if fetch is not None:
+            return fetch
+        fetch = UpstreamFetch(key, url, headers, timeout, on_complete, hedge)
+        inflight_fetches[key] = fetch
+    threading.Thread(target=fetch.run, name="upstream-fetch", daemon=True).start()
+    return fetch
+
 # Funzione per normalizzare il testo (rimuovere accenti, minuscolo, ecc.)
 def normalize_text(text):
     """
@@ -53,6 +1115,46 @@ def normalize_text(text):
     text = re.sub(r'[\u0300-\u036f]', '', text)  # Rimuovi accenti
     return text.lower().strip()
 
+# Normalizza un URL upstream per usarlo come chiave di cache
+def normalize_upstream_url(url):
+    """
+    Normalizza l'URL (schema e host minuscoli, porta di default e frammento rimossi)
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parsed.path or "/"
+    query = f"?{parsed.query}" if parsed.query else ""
+    return f"{scheme}://{netloc}{path}{query}"
+
+def segment_directory(url):
+    """Restituisce la directory (normalizzata) che contiene il segmento o la playlist"""
+    return normalize_upstream_url(url).split("?", 1)[0].rsplit("/", 1)[0] + "/"
+
+def parse_target_duration(content):
+    """Estrae il valore di #EXT-X-TARGETDURATION dalla playlist, se presente"""
+    match = re.search(r'^#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)', content, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+def remember_target_duration(segment_url, target_duration):
+    """Memorizza la target duration della playlist per la directory dei suoi segmenti"""
+    directory = segment_directory(segment_url)
+    with target_duration_lock:
+        target_duration_hints[directory] = target_duration
+        target_duration_hints.move_to_end(directory)
+        while len(target_duration_hints) > TARGET_DURATION_HINTS_MAX:
+            target_duration_hints.popitem(last=False)
+
+def segment_cache_ttl(segment_url):
+    """TTL di un segmento in cache: alcune target duration della sua playlist"""
+    with target_duration_lock:
+        target_duration = target_duration_hints.get(segment_directory(segment_url))
+    if not target_duration:
+        return SEGMENT_CACHE_DEFAULT_TTL
+    return target_duration * SEGMENT_CACHE_TTL_MULTIPLIER
+
 # Carica il file JSON dei loghi
 def load_logos():
     global CACHE_LOGOS, CACHE_LOGOS_TIMESTAMP
@@ -89,12 +1191,13 @@ def load_logos():
         return CACHE_LOGOS if CACHE_LOGOS else {}
 
 # Funzione per trovare il logo corrispondente a un canale
-def find_logo_for_channel(channel_name):
+def find_logo_for_channel(channel_name, logos=None):
     """
     Trova il logo corrispondente a un canale con vari metodi di confronto
     """
     # Accedi alla variabile globale
-    logos = load_logos()
+    if logos is None:
+        logos = load_logos()
     
     # Cerca una corrispondenza esatta
     if channel_name in logos:
@@ -108,66 +1211,824 @@ def find_logo_for_channel(channel_name):
     # Se non viene trovato un logo, restituisci un URL di placeholder
     return f"https://placehold.co/300x300?text={quote(channel_name)}&.jpg"
 
+# Stato del refresh dei canali (al massimo un refresh in corso per processo)
+channels_refresh_lock = threading.Lock()
+channels_refresh_state = {
+    "last_attempt": 0,
+    "last_success": 0,
+    "last_error": None,
+    "last_error_at": 0,
+    "consecutive_failures": 0,
+    "retry_at": 0
+}
+channels_refresher_pid = None
+channels_refresher_lock = threading.Lock()
+channels_refresher_wakeup = threading.Event()
+
+# Lista canali di vavoo.to: analizzata in streaming, tenendo solo i campi usati dall'indice
+ChannelRecord = namedtuple('ChannelRecord', ['id', 'name'])
+CHANNELS_COUNTRY = "Italy"
+CHANNELS_PARSE_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(chunks):
+    """
+    Parser incrementale di un array JSON: restituisce gli elementi uno alla volta man mano
+    che arrivano i chunk (bytes UTF-8), senza tenere in memoria l'intero documento
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    state = "start"  # start -> first -> (value, separator)* -> end
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        buffer += text_decoder.decode(b"" if final else chunk, final)
+        position = 0
+        batch_tried = False
+        while True:
+            position = JSON_WHITESPACE.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+            char = buffer[position]
+            if state == "start":
+                if char != "[":
+                    raise ValueError("La lista canali non è un array JSON")
+                position += 1
+                state = "first"
+            elif state == "separator" or (state == "first" and char == "]"):
+                if char == "]":
+                    position += 1
+                    state = "end"
+                elif char == ",":
+                    position += 1
+                    state = "value"
+                else:
+                    raise ValueError(f"Carattere inatteso nella lista canali: {char!r}")
+            elif state in ("first", "value"):
+                if char == "{" and not batch_tried:
+                    # Percorso veloce: tutti gli oggetti completi del buffer in una sola chiamata al
+                    # decoder C. Se il taglio cade dentro una stringa o un oggetto annidato il
+                    # frammento non è JSON valido e si procede un elemento alla volta
+                    batch_tried = True
+                    cut = buffer.rfind("},", position)
+                    if cut > position:
+                        try:
+                            items = json.loads("[" + buffer[position:cut + 1] + "]")
+                        except ValueError:
+                            items = None
+                        if items is not None:
+                            yield from items
+                            position = cut + 2
+                            state = "value"
+                            continue
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break  # Elemento non ancora completo: serve il prossimo chunk
+                if not final and (end == len(buffer) or buffer[end] not in ",] \t\n\r"):
+                    break  # Un numero a fine buffer potrebbe continuare nel prossimo chunk
+                yield item
+                position = end
+                state = "separator"
+            else:
+                raise ValueError("Dati inattesi dopo la fine della lista canali")
+        buffer = buffer[position:]
+    if state != "end":
+        raise ValueError("Lista canali JSON incompleta")
+
+def parse_channel_records(chunks, country=CHANNELS_COUNTRY):
+    """Estrae dalla lista canali in streaming i soli canali del paese indicato, come ChannelRecord"""
+    records = []
+    for channel in iter_json_array(chunks):
+        if isinstance(channel, dict) and channel.get("country") == country:
+            records.append(ChannelRecord(id=channel["id"], name=channel["name"]))
+    return records
+
+def fetch_italian_channels():
+    """Scarica da vavoo.to la lista dei canali e tiene solo quelli italiani"""
+    logger.info("Richiesta canali a vavoo.to API")
+    started = time.perf_counter()
+    ttfb = None
+    received = [0]
+
+    def counted_chunks(response):
+        for chunk in response.iter_content(CHANNELS_PARSE_CHUNK_SIZE):
+            received[0] += len(chunk)
+            yield chunk
+
+    try:
+        with upstream_get(VAVOO_API_URL, headers=DEFAULT_HEADERS, timeout=15, stream=True) as response:
+            ttfb = response.elapsed.total_seconds()
+            response.raise_for_status()
+            italian_channels = parse_channel_records(counted_chunks(response))
+    except requests.RequestException:
+        record_upstream(VAVOO_API_URL, ttfb, time.perf_counter() - started, received[0], False)
+        raise
+    record_upstream(VAVOO_API_URL, ttfb, time.perf_counter() - started, received[0], True)
+    
+    if not italian_channels:
+        raise ValueError("Nessun canale italiano trovato")
+    return italian_channels
+
+channels_snapshot_state = {
+    "mtime_ns": None,  # Versione (mtime) dell'ultimo snapshot letto o scritto da questo processo
+    "created_at": 0,
+    "adopted": 0,
+    "written": 0
+}
+
+@contextmanager
+def shared_refresh_lock(wait):
+    """
+    Lock tra i worker del nodo: un solo processo alla volta scarica i canali da vavoo.to
+    """
+    if fcntl is None:
+        yield True
+        return
+    try:
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        fd = os.open(CHANNELS_SNAPSHOT_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        logger.warning(f"Lock condiviso non disponibile, refresh locale: {str(e)}")
+        yield True
+        return
+
+    try:
+        deadline = time.time() + CHANNELS_COLD_START_WAIT
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if not wait or time.time() >= deadline:
+                    acquired = False
+                    break
+                time.sleep(0.2)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+def publish_channel_index(index, timestamp):
+    """Rende visibile ai thread del worker il nuovo indice dei canali"""
+    global channel_index, channels_cache, cache_timestamp
+    previous = channel_index
+    if index is previous:
+        # Lista canali invariata: si rinnova solo la scadenza, le risposte in cache restano valide
+        channels_diff_state["unchanged"] += 1
+    else:
+        started = time.perf_counter()
+        record_channels_diff(previous, index)
+        invalidate_responses(previous, index)
+        channels_diff_state["updates"] += 1
+        channels_diff_state["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        channel_index = index
+        channels_cache = index.entries
+        if not startup_state["ready_at"] and index.entries:
+            startup_state["ready_at"] = time.time()
+    cache_timestamp = timestamp
+    channels_refresh_state["last_success"] = timestamp
+    channels_refresh_state["consecutive_failures"] = 0
+    channels_refresh_state["retry_at"] = 0
+
+def record_channels_diff(previous, index):
+    """Conta canali aggiunti, rimossi e rinominati rispetto all'indice precedente"""
+    old_names = {entry.id: entry.name for entry in previous.entries} if previous is not None else {}
+    new_names = {entry.id: entry.name for entry in index.entries}
+    channels_diff_state["added"] = len(new_names.keys() - old_names.keys())
+    channels_diff_state["removed"] = len(old_names.keys() - new_names.keys())
+    channels_diff_state["renamed"] = sum(1 for channel_id, name in new_names.items()
+                                         if channel_id in old_names and old_names[channel_id] != name)
+    logger.info(f"Indice canali aggiornato: {channels_diff_state['added']} aggiunti, "
+                f"{channels_diff_state['removed']} rimossi, {channels_diff_state['renamed']} rinominati")
+
+def write_channels_snapshot(index, created_at):
+    """Scrive in modo atomico lo snapshot condiviso dell'indice dei canali"""
+    try:
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=SHARED_STATE_DIR, prefix='.channels-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({
+                    "format": CHANNELS_SNAPSHOT_FORMAT,
+                    "created_at": created_at,
+                    "fields": list(ChannelEntry._fields),
+                    "channels": [list(entry) for entry in index.entries]
+                }, file, ensure_ascii=False, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, CHANNELS_SNAPSHOT_PATH)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        channels_snapshot_state["mtime_ns"] = os.stat(CHANNELS_SNAPSHOT_PATH).st_mtime_ns
+        channels_snapshot_state["created_at"] = created_at
+        channels_snapshot_state["written"] += 1
+    except OSError as e:
+        logger.warning(f"Impossibile scrivere lo snapshot dei canali: {str(e)}")
+
+def adopt_channels_snapshot():
+    """
+    Carica lo snapshot scritto da un altro worker se è più recente della copia locale.
+    Restituisce True se i canali locali sono abbastanza freschi da non dover interrogare vavoo.to
+    """
+    try:
+        mtime_ns = os.stat(CHANNELS_SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+
+    if mtime_ns is not None and mtime_ns != channels_snapshot_state["mtime_ns"]:
+        try:
+            with open(CHANNELS_SNAPSHOT_PATH, 'r', encoding='utf-8') as file:
+                snapshot = json.load(file)
+            if snapshot.get("format") != CHANNELS_SNAPSHOT_FORMAT:
+                raise ValueError(f"formato {snapshot.get('format')} non supportato")
+            created_at = snapshot["created_at"]
+            if created_at > cache_timestamp:
+                fields = snapshot["fields"]
+                entries = [ChannelEntry(**dict(zip(fields, values))) for values in snapshot["channels"]]
+                publish_channel_index(index_channel_entries(entries, channel_index), created_at)
+                channels_snapshot_state["created_at"] = created_at
+                channels_snapshot_state["adopted"] += 1
+                logger.info(f"Canali caricati dallo snapshot condiviso: {len(entries)}")
+            channels_snapshot_state["mtime_ns"] = mtime_ns
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Snapshot dei canali non leggibile: {str(e)}")
+
+    return bool(cache_timestamp) and time.time() < cache_timestamp + CACHE_DURATION - CHANNELS_REFRESH_AHEAD
+
+def refresh_italian_channels(wait=False):
+    """
+    Aggiorna i canali dallo snapshot condiviso o, se nessun worker l'ha rinnovato, da vavoo.to.
+    Se un refresh è già in corso ritorna subito (wait=False) oppure ne attende la fine
+    (wait=True). Restituisce False se non ha tentato.
+    """
+    state = channels_refresh_state
+    if wait:
+        if not channels_refresh_lock.acquire(timeout=CHANNELS_COLD_START_WAIT):
+            return False
+    elif not channels_refresh_lock.acquire(blocking=False):
+        return False
+
+    try:
+        # Chi ha atteso trova i canali appena caricati (o l'errore appena registrato)
+        if wait and (channels_cache or time.time() < state["retry_at"]):
+            return False
+
+        # Un altro worker potrebbe aver già pubblicato una lista aggiornata
+        if adopt_channels_snapshot():
+            return True
+
+        with shared_refresh_lock(wait) as acquired:
+            if not acquired:
+                return False
+            if adopt_channels_snapshot():
+                return True
+
+            state["last_attempt"] = time.time()
+            try:
+                italian_channels = fetch_italian_channels()
+                index = build_channel_index(italian_channels, load_logos(), channel_index)
+            except requests.Timeout:
+                error = "Timeout nella richiesta dei canali"
+            except requests.RequestException as e:
+                error = f"Errore nella richiesta dei canali: {str(e)}"
+            except Exception as e:
+                error = f"Errore generico nel caricamento dei canali: {str(e)}"
+            else:
+                # Aggiorna la cache e la condivide con gli altri worker
+                created_at = time.time()
+                publish_channel_index(index, created_at)
+                write_channels_snapshot(index, created_at)
+                logger.info(f"Canali italiani caricati: {len(italian_channels)}")
+                return True
+
+        # Backoff esponenziale prima del prossimo tentativo
+        state["consecutive_failures"] += 1
+        delay = min(CHANNELS_REFRESH_BACKOFF_BASE * 2 ** (state["consecutive_failures"] - 1), CHANNELS_REFRESH_BACKOFF_MAX)
+        state["retry_at"] = time.time() + delay
+        state["last_error"] = error
+        state["last_error_at"] = time.time()
+        logger.error(f"{error} (nuovo tentativo tra {delay}s)")
+        return True
+    finally:
+        channels_refresh_lock.release()
+
+def channels_refresher_loop():
+    """Rinnova la lista canali prima della scadenza, con backoff in caso di errori"""
+    while True:
+        now = time.time()
+        if channels_refresh_state["retry_at"]:
+            due = channels_refresh_state["retry_at"]
+        elif cache_timestamp:
+            due = cache_timestamp + CACHE_DURATION - CHANNELS_REFRESH_AHEAD
+        else:
+            due = now
+
+        if due > now:
+            channels_refresher_wakeup.wait(due - now)
+            channels_refresher_wakeup.clear()
+            continue
+
+        try:
+            attempted = refresh_italian_channels()
+        except Exception as e:
+            logger.error(f"Errore nel refresh dei canali: {str(e)}")
+            attempted = False
+        if not attempted:
+            # Un altro thread sta già aggiornando i canali
+            channels_refresher_wakeup.wait(1)
+            channels_refresher_wakeup.clear()
+
+def ensure_channels_refresher():
+    """Avvia il thread di refresh dei canali (uno per processo, anche dopo un fork)"""
+    global channels_refresher_pid
+    pid = os.getpid()
+    if channels_refresher_pid == pid:
+        return
+    with channels_refresher_lock:
+        if channels_refresher_pid != pid:
+            threading.Thread(target=channels_refresher_loop, name="channels-refresher", daemon=True).start()
+            channels_refresher_pid = pid
+
 # Funzione per caricare e filtrare i canali italiani da vavoo.to
 def load_italian_channels():
-    global channels_cache, cache_timestamp
-    current_time = time.time()
+    ensure_channels_refresher()
     
-    # Usa la cache se disponibile e non scaduta
-    if channels_cache and current_time - cache_timestamp < CACHE_DURATION:
-        logger.debug(f"Utilizzo cache canali ({len(channels_cache)} canali)")
+    # Usa la cache se disponibile: se è scaduta la serviamo comunque mentre si aggiorna
+    if channels_cache:
+        if time.time() - cache_timestamp >= CACHE_DURATION:
+            logger.debug(f"Cache canali scaduta, servita la copia precedente ({len(channels_cache)} canali)")
+            channels_refresher_wakeup.set()
         return channels_cache
     
+    # Avvio a freddo: non c'è nulla da servire, attendiamo l'unico refresh del processo
+    if time.time() >= channels_refresh_state["retry_at"]:
+        refresh_italian_channels(wait=True)
+    return channels_cache if channels_cache else []
+
+class GenreClassifier:
+    """
+    Classificatore dei generi: le parole chiave di tutte le regole sono compilate in
+    un'unica espressione regolare, con un gruppo per genere nell'ordine delle regole
+    """
+    def __init__(self, rules):
+        self.genres = [rule["genre"] for rule in rules]
+        groups = []
+        for priority, rule in enumerate(rules):
+            keywords = sorted({keyword.lower() for keyword in rule.get("keywords", []) if keyword}, key=len, reverse=True)
+            if keywords:
+                groups.append(f"(?P<g{priority}>{'|'.join(re.escape(keyword) for keyword in keywords)})")
+        # Lookahead: una corrispondenza per ogni posizione del nome, anche sovrapposta alle altre.
+        # A parità di posizione l'alternativa scelta è quella del genere con priorità più alta
+        self.pattern = re.compile(f"(?=(?:{'|'.join(groups)}))") if groups else None
+        self.classify = functools.lru_cache(maxsize=GENRE_CACHE_SIZE)(self._classify)
+
+    def _classify(self, channel_name):
+        """Restituisce il primo genere (nell'ordine delle regole) con una parola chiave contenuta nel nome"""
+        best = None
+        if self.pattern is not None:
+            for match in self.pattern.finditer(channel_name):
+                priority = int(match.lastgroup[1:])
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+        return self.genres[best] if best is not None else "GENERAL"
+
+def load_genre_rules():
+    """Carica le regole dei generi dal file JSON nella stessa directory dello script"""
     try:
-        logger.info("Richiesta canali a vavoo.to API")
-        response = requests.get(VAVOO_API_URL, headers=DEFAULT_HEADERS, timeout=15)
-        response.raise_for_status()
-        
-        all_channels = response.json()
-        italian_channels = [ch for ch in all_channels if ch.get("country") == "Italy"]
-        
-        if not italian_channels:
-            logger.warning("Nessun canale italiano trovato")
-            return channels_cache if channels_cache else []
-        
-        # Aggiorna la cache
-        channels_cache = italian_channels
-        cache_timestamp = current_time
-        
-        logger.info(f"Canali italiani caricati: {len(italian_channels)}")
-        return italian_channels
-    except requests.Timeout:
-        logger.error("Timeout nella richiesta dei canali")
-        return channels_cache if channels_cache else []
-    except requests.RequestException as e:
-        logger.error(f"Errore nella richiesta dei canali: {str(e)}")
-        return channels_cache if channels_cache else []
+        rules_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), GENRE_RULES_FILE)
+        with open(rules_file_path, 'r', encoding='utf-8') as file:
+            rules = json.load(file)
+        logger.info(f"Regole dei generi caricate: {len(rules)}")
+        return rules
     except Exception as e:
-        logger.error(f"Errore generico nel caricamento dei canali: {str(e)}")
-        return channels_cache if channels_cache else []
+        logger.error(f"Errore nel caricamento delle regole dei generi: {str(e)}")
+        return []
+
+genre_classifier = GenreClassifier(load_genre_rules())
 
 def get_channel_genre(channel_name):
     """Determina il genere del canale in base al nome"""
     if not channel_name:
         return "GENERAL"
-        
-    channel_name = channel_name.lower()
-    
-    genres = {
-        "SPORT": ["sport", "calcio", "football", "tennis", "basket", "motogp", "f1", "golf"],
-        "NEWS": ["news", "tg", "24", "meteo", "giornale", "notizie"],
-        "KIDS": ["kids", "bambini", "cartoon", "disney", "nick", "boing", "junior"],
-        "MOVIES": ["cinema", "film", "movie", "premium", "comedy"],
-        "DOCUMENTARIES": ["discovery", "history", "national", "geo", "natura", "science"],
-        "MUSIC": ["music", "mtv", "vh1", "radio", "hit", "rock"]
+    return genre_classifier.classify(channel_name.lower())
+
+def get_catalog_genres():
+    """Generi elencati nel manifest, nell'ordine delle regole"""
+    genres = list(dict.fromkeys(genre_classifier.genres))
+    if "GENERAL" not in genres:
+        genres.append("GENERAL")
+    return genres
+
+class ChannelSearchIndex:
+    """
+    Indice invertito di n-grammi (fino ai trigrammi) sui nomi normalizzati dei canali.
+    Le liste degli n-grammi contengono slot stabili tra un refresh e l'altro (slot -> posizione
+    in `rank`), così un aggiornamento tocca solo gli n-grammi dei canali aggiunti o rimossi
+    """
+    NGRAM_SIZE = 3
+
+    def __init__(self, entries, previous=None, reused_slots=None):
+        """
+        previous/reused_slots: indice precedente e, per ogni posizione di entries, lo slot
+        del canale invariato in previous (None per i canali nuovi)
+        """
+        self.entries = tuple(entries)
+        if previous is not None and previous.slot_count <= 2 * len(self.entries) + 64:
+            self._update(previous, reused_slots)
+        else:
+            # Costruzione completa (anche per compattare gli slot dopo molti aggiornamenti)
+            self.slots = list(range(len(self.entries)))
+            self.slot_count = len(self.slots)
+            postings = {}
+            for position, entry in enumerate(self.entries):
+                for gram in self._grams(entry.norm_name):
+                    postings.setdefault(gram, set()).add(position)
+            self.postings = {gram: frozenset(slots) for gram, slots in postings.items()}
+        self.rank = [None] * self.slot_count
+        for position, slot in enumerate(self.slots):
+            self.rank[slot] = position
+        self._recent = OrderedDict()  # query normalizzata -> risultati
+        self._lock = threading.Lock()
+
+    def _grams(self, name):
+        grams = set()
+        for size in range(1, self.NGRAM_SIZE + 1):
+            for start in range(len(name) - size + 1):
+                grams.add(name[start:start + size])
+        return grams
+
+    def _update(self, previous, reused_slots):
+        """Copia le liste dell'indice precedente e aggiorna solo quelle degli n-grammi cambiati"""
+        slot_count = previous.slot_count
+        added = {}
+        removed = {}
+        self.slots = []
+        for entry, slot in zip(self.entries, reused_slots):
+            if slot is None:
+                slot = slot_count
+                slot_count += 1
+                for gram in self._grams(entry.norm_name):
+                    added.setdefault(gram, set()).add(slot)
+            self.slots.append(slot)
+        kept = set(self.slots)
+        for position, slot in enumerate(previous.slots):
+            if slot not in kept:
+                for gram in self._grams(previous.entries[position].norm_name):
+                    removed.setdefault(gram, set()).add(slot)
+        self.slot_count = slot_count
+        self.postings = dict(previous.postings)
+        for gram in added.keys() | removed.keys():
+            slots = (self.postings.get(gram, frozenset()) - removed.get(gram, set())) | added.get(gram, set())
+            if slots:
+                self.postings[gram] = frozenset(slots)
+            else:
+                self.postings.pop(gram, None)
+
+    def _candidates(self, query):
+        """Posizioni dei canali il cui nome contiene la query (già normalizzata)"""
+        size = min(len(query), self.NGRAM_SIZE)
+        grams = {query[start:start + size] for start in range(len(query) - size + 1)}
+        postings = sorted((self.postings.get(gram, frozenset()) for gram in grams), key=len)
+        candidates = sorted(self.rank[slot] for slot in set(postings[0]).intersection(*postings[1:]))
+        if len(query) > self.NGRAM_SIZE:
+            # Gli n-grammi restringono i candidati, la sottostringa va comunque verificata
+            candidates = [position for position in candidates if query in self.entries[position].norm_name]
+        return candidates
+
+    def search(self, query):
+        """
+        Restituisce i canali il cui nome normalizzato contiene la query (senza accenti e
+        maiuscole), in ordine alfabetico o con prima le corrispondenze a inizio nome/parola
+        """
+        with self._lock:
+            results = self._recent.get(query)
+            if results is not None:
+                self._recent.move_to_end(query)
+                return results
+
+        if not query:
+            results = self.entries
+        else:
+            results = [self.entries[position] for position in self._candidates(query)]
+            if SEARCH_PREFIX_RANKING:
+                word_prefix = " " + query
+                results.sort(key=lambda entry: 0 if entry.norm_name.startswith(query)
+                             else 1 if word_prefix in entry.norm_name else 2)
+            results = tuple(results)
+
+        with self._lock:
+            self._recent[query] = results
+            while len(self._recent) > SEARCH_CACHE_SIZE:
+                self._recent.popitem(last=False)
+        return results
+
+# Indice dei canali, ricostruito solo quando cambiano i canali o i loghi
+ChannelEntry = namedtuple('ChannelEntry', ['id', 'name', 'norm_name', 'genre', 'logo'])
+ChannelIndex = namedtuple('ChannelIndex', ['version', 'entries', 'by_id', 'by_genre', 'search', 'built_at', 'logos'])
+
+channel_index = None
+channel_index_versions = itertools.count(1)
+
+# Esito dell'ultimo aggiornamento dell'indice (differenze rispetto al precedente)
+channels_diff_state = {
+    "updates": 0,
+    "unchanged": 0,
+    "added": 0,
+    "removed": 0,
+    "renamed": 0,
+    "recomputed_entries": 0,
+    "reused_entries": 0,
+    "responses_invalidated": 0,
+    "responses_kept": 0,
+    "duration_ms": 0
+}
+
+def build_channel_index(channels, logos, previous=None):
+    """
+    Costruisce l'indice immutabile dei canali: id -> canale, ordine per nome e
+    nome normalizzato, genere e logo già calcolati per ogni canale.
+    Con previous (e gli stessi loghi) i canali con id e nome invariati riusano i dati già
+    calcolati: si ricalcolano solo quelli aggiunti o rinominati
+    """
+    reusable = {}
+    if previous is not None and previous.logos is not None and (previous.logos is logos or previous.logos == logos):
+        reusable = {(entry.id, entry.name): entry for entry in previous.entries}
+    entries = []
+    recomputed = 0
+    for channel in sorted(channels, key=lambda ch: ch.name):
+        name = channel.name
+        channel_id = str(channel.id)
+        entry = reusable.get((channel_id, name))
+        if entry is None:
+            recomputed += 1
+            entry = ChannelEntry(
+                id=channel_id,
+                name=name,
+                norm_name=normalize_text(name),
+                genre=get_channel_genre(name),
+                logo=find_logo_for_channel(name, logos)
+            )
+        entries.append(entry)
+    channels_diff_state["recomputed_entries"] = recomputed
+    channels_diff_state["reused_entries"] = len(entries) - recomputed
+    return index_channel_entries(entries, previous, logos)
+
+def index_channel_entries(entries, previous=None, logos=None):
+    """
+    Costruisce le strutture di lookup a partire dai canali già elaborati e ordinati.
+    Se i canali coincidono con quelli di previous restituisce previous (stessa versione,
+    nessuna risposta in cache da invalidare)
+    """
+    entries = tuple(entries)
+    if previous is not None and previous.entries == entries:
+        return previous
+
+    by_id = {}
+    by_genre = {}
+    for entry in entries:
+        by_id.setdefault(entry.id, entry)  # Come la ricerca lineare: vince il primo canale con quell'ID
+        by_genre.setdefault(entry.genre, []).append(entry)
+
+    if previous is not None:
+        # Slot del canale identico nell'indice precedente, per aggiornare la ricerca in modo incrementale
+        old_positions = {}
+        for position, entry in enumerate(previous.entries):
+            old_positions.setdefault(entry, []).append(position)
+        reused_slots = []
+        for entry in entries:
+            positions = old_positions.get(entry)
+            reused_slots.append(previous.search.slots[positions.pop()] if positions else None)
+        search = ChannelSearchIndex(entries, previous.search, reused_slots)
+    else:
+        search = ChannelSearchIndex(entries)
+
+    return ChannelIndex(
+        version=next(channel_index_versions),
+        entries=entries,
+        by_id=MappingProxyType(by_id),
+        by_genre=MappingProxyType({genre: tuple(items) for genre, items in by_genre.items()}),
+        search=search,
+        built_at=time.time(),
+        logos=logos
+    )
+
+EMPTY_CHANNEL_INDEX = index_channel_entries([])
+
+def get_channel_index():
+    """
+    Restituisce l'indice dei canali corrente (ricostruito a ogni refresh dei canali)
+    """
+    load_italian_channels()
+    return channel_index or EMPTY_CHANNEL_INDEX
+
+# Risposte già serializzate: a ogni nuovo indice si eliminano solo quelle che cambiano
+response_cache = ByteLRUCache("responses", RESPONSE_CACHE_MAX_BYTES)
+response_cache_version = 0  # versione dell'indice a cui corrispondono le risposte in cache
+response_cache_lock = threading.Lock()
+
+def cached_json_response(key, build_payload):
+    """
+    Restituisce la risposta JSON per la chiave usando i byte già serializzati, con ETag
+    e risposta 304 se il client ha già la versione corrente
+    """
+    body, etag = cached_json(get_channel_index(), key, build_payload)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={RESPONSE_CACHE_MAX_AGE}"
+    return response
+
+def cached_json(index, key, build_payload):
+    """Corpo JSON serializzato ed ETag per la chiave, dalla cache o calcolati con l'indice"""
+    cached = response_cache.get(key)
+    if cached is None:
+        payload = build_payload(index)
+        body = jsonify(payload).get_data()
+        cached = (body, hashlib.sha1(body).hexdigest())
+        # Le risposte "non trovato" non vengono conservate (chiavi arbitrarie dai client)
+        if all(value is not None for value in payload.values()):
+            with response_cache_lock:
+                # Una risposta calcolata con un indice già sostituito non va conservata
+                if index.version == response_cache_version:
+                    response_cache.put(key, cached, CACHE_DURATION, size=len(body))
+    return cached
+
+def stale_response_keys(previous, index):
+    """
+    Chiavi delle risposte in cache che cambiano passando da previous a index: i meta dei
+    canali aggiunti, rimossi o modificati e le pagine di catalogo con canali diversi
+    """
+    keys = response_cache.keys()
+    if previous is None:
+        return keys
+    changed_ids = {channel_id for channel_id in previous.by_id.keys() | index.by_id.keys()
+                   if previous.by_id.get(channel_id) != index.by_id.get(channel_id)}
+    stale = []
+    for key in keys:
+        if key[0] == "meta":
+            if key[1] in changed_ids:
+                stale.append(key)
+        elif key[0] == "catalog":
+            _, search, genre, skip = key
+            if select_catalog_entries(previous, search, skip, genre) != select_catalog_entries(index, search, skip, genre):
+                stale.append(key)
+        else:
+            stale.append(key)
+    return stale
+
+def invalidate_responses(previous, index):
+    """Allinea la cache delle risposte al nuovo indice eliminando solo le risposte cambiate"""
+    global response_cache_version
+    with response_cache_lock:
+        # Prima la versione, così le richieste ancora in corso sul vecchio indice non possono più
+        # inserire risposte; poi l'elenco delle chiavi, che include tutto ciò che è già stato inserito
+        response_cache_version = index.version
+        stale = stale_response_keys(previous, index)
+        for key in stale:
+            response_cache.discard(key)
+    channels_diff_state["responses_invalidated"] = len(stale)
+    channels_diff_state["responses_kept"] = response_cache.stats()["entries"]
+
+def build_catalog_meta(entry):
+    """Meta di un canale per il catalogo Stremio"""
+    return {
+        "id": f"{ID_PREFIX}{entry.id}",  # Aggiungi il prefisso all'ID
+        "type": "tv",
+        "name": entry.name,
+        "genres": [entry.genre],
+        "poster": entry.logo,  # Usa il logo del canale come poster
+        "posterShape": "square",
+        "background": f"https://via.placeholder.com/1280x720/000080/FFFFFF?text={quote(entry.name)}",
+        "logo": entry.logo  # Usa lo stesso logo come icona del canale
     }
-    
-    for genre, keywords in genres.items():
-        for keyword in keywords:
-            if keyword in channel_name:
-                return genre
-    
-    return "GENERAL"
+
+# Metriche delle richieste Flask
+@app.before_request
+def start_request_metrics():
+    if not METRICS_ENABLED:
+        return
+    metrics_registry.ensure_flusher()
+    g.metrics_route = METRICS_ROUTES.get(request.endpoint, "other")
+    g.metrics_started = time.perf_counter()
+    metrics_registry.inc("vavoo_http_requests_in_flight", (("route", g.metrics_route),))
+
+def count_sent_bytes(chunks, sent):
+    """Restituisce i chunk della risposta sommando in sent[0] i byte effettivamente inviati"""
+    for chunk in chunks:
+        sent[0] += len(chunk)
+        yield chunk
+
+@app.after_request
+def finish_request_metrics(response):
+    route = g.pop("metrics_route", None)
+    if route is None:
+        return response
+    started = g.metrics_started
+    status_code = response.status_code
+    content_length = response.content_length
+    sent = None
+    if route.startswith("proxy_") and response.is_streamed and not response.direct_passthrough:
+        # Le risposte in streaming (spesso senza Content-Length) si misurano contando i byte inviati
+        sent = [0]
+        response.response = count_sent_bytes(response.response, sent)
+
+    def record():
+        # Eseguita dal server dopo l'invio dell'ultimo byte (anche per le risposte in streaming)
+        labels = (("route", route),)
+        metrics_registry.inc("vavoo_http_requests_in_flight", labels, -1)
+        metrics_registry.observe("vavoo_http_request_duration_seconds", labels, time.perf_counter() - started)
+        metrics_registry.inc("vavoo_http_requests_total", (("route", route), ("status", str(status_code))))
+        proxied = sent[0] if sent is not None else content_length
+        if proxied and route.startswith("proxy_"):
+            metrics_registry.inc("vavoo_proxied_bytes_total", labels, proxied)
+
+    if response.direct_passthrough:
+        # Il file va restituito così com'è al server (sendfile) e le callback di chiusura non verrebbero
+        # eseguite: registriamo subito, con la durata fino all'inizio dell'invio
+        record()
+    else:
+        response.call_on_close(record)
+    return response
+
+def call_on_file_close(file_wrapper, callback):
+    """Esegue callback quando il server chiude il file di una risposta direct_passthrough (anche se il client si disconnette)"""
+    close = getattr(file_wrapper, "close", None)
+
+    def close_and_notify():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    # Si sostituisce il metodo sull'istanza: il server riconosce il tipo del wrapper per usare sendfile
+    file_wrapper.close = close_and_notify
+
+# Controllo di ammissione delle richieste Flask (dopo le metriche, così i 503 vengono contati)
+@app.before_request
+def admit_request():
+    if not ADMISSION_ENABLED or request.endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return
+    limiter = proxy_admission if request.endpoint in ("proxy_m3u", "proxy_ts") else metadata_admission
+    if not limiter.acquire():
+        logger.warning(f"Richiesta rifiutata per sovraccarico ({limiter.name}): {request.path}")
+        return Response("Errore: server sovraccarico, riprovare più tardi", status=503,
+                        headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+    g.admission_limiter = limiter
+
+@app.after_request
+def release_admission(response):
+    limiter = g.pop("admission_limiter", None)
+    if limiter is None:
+        return response
+    if response.direct_passthrough:
+        # Con sendfile le callback di chiusura non vengono eseguite: il posto si libera alla chiusura del file
+        call_on_file_close(response.response, limiter.release)
+    else:
+        # Il posto resta occupato fino all'invio dell'ultimo byte
+        response.call_on_close(limiter.release)
+    return response
+
+def collect_cache_metrics():
+    """Contatori delle cache e dei download in corso, letti al momento dell'export"""
+    caches = [segment_cache, playlist_cache, response_cache]
+    for cache in caches:
+        stats = cache.stats()
+        labels = (("cache", cache.name),)
+        yield "vavoo_cache_hits_total", labels, stats["hits"]
+        yield "vavoo_cache_misses_total", labels, stats["misses"]
+        yield "vavoo_cache_evictions_total", labels, stats["evictions"]
+        yield "vavoo_cache_bytes", labels, stats["bytes"]
+    if segment_disk_cache is not None:
+        stats = segment_disk_cache.stats()
+        labels = (("cache", "segments_disk"),)
+        yield "vavoo_cache_hits_total", labels, stats["hits"]
+        yield "vavoo_cache_misses_total", labels, stats["misses"]
+        yield "vavoo_cache_evictions_total", labels, stats["evictions"]
+        yield "vavoo_disk_cache_bytes", (), stats["bytes"]
+    yield "vavoo_upstream_in_flight", (), len(inflight_fetches)
+    for limiter in (proxy_admission, metadata_admission):
+        stats = limiter.stats()
+        labels = (("class", limiter.name),)
+        yield "vavoo_admission_active", labels, stats["active"]
+        yield "vavoo_admission_waiting", labels, stats["waiting"]
+        yield "vavoo_admission_rejected_total", labels, stats["rejected"] + stats["timed_out"]
+        yield "vavoo_admission_limit", labels, stats["limit"]
+
+metrics_registry.add_collector(collect_cache_metrics)
 
 # Ottieni l'URL base con HTTPS quando possibile
 def get_base_url():
@@ -214,7 +2075,7 @@ def manifest_json():
                     {"name": "genre", "isRequired": False},
                     {"name": "skip", "isRequired": False}
                 ],
-                "genres": ["SPORT", "NEWS", "KIDS", "MOVIES", "DOCUMENTARIES", "MUSIC", "GENERAL"]
+                "genres": get_catalog_genres()
             }
         ],
         "behaviorHints": {
@@ -282,30 +2143,43 @@ def catalog_with_extra(type, id, extra):
     return get_catalog_response(type, id, search, skip, genre)
 
 def get_catalog_response(type, id, search, skip, genre=""):
-    channels = load_italian_channels()
+    return cached_json_response(
+        catalog_cache_key(search, skip, genre),
+        lambda index: build_catalog_payload(index, search, skip, genre)
+    )
+
+def catalog_cache_key(search, skip, genre=""):
+    return ("catalog", search, genre, skip)
+
+def filter_catalog_entries(index, search, genre=""):
+    """Canali del catalogo per ricerca e genere, nell'ordine dell'indice"""
+    # Filtra per la ricerca se specificata (indice di n-grammi costruito al refresh)
+    if search:
+        channels = index.search.search(normalize_text(search))
+    else:
+        channels = None
     
-    # Filtra per la ricerca se specificata
+    # Filtra per genere se specificato (senza ricerca usiamo la lista già ordinata del genere)
+    if genre:
+        if channels is None:
+            channels = index.by_genre.get(genre, ())
+        else:
+            channels = tuple(entry for entry in channels if entry.genre == genre)
+    elif channels is None:
+        channels = index.entries
+    return channels
+
+def select_catalog_entries(index, search, skip, genre=""):
+    """Canali di una pagina del catalogo (l'indice è già ordinato)"""
+    return tuple(filter_catalog_entries(index, search, genre)[skip:skip+100])
+
+def build_catalog_payload(index, search, skip, genre=""):
     if search:
         logger.info(f"Ricerca canali con query: {search}")
-        search_norm = normalize_text(search)
-        channels = [ch for ch in channels if search_norm in normalize_text(ch["name"])]
-        logger.info(f"Trovati {len(channels)} canali per la ricerca '{search}'")
-    
-    # Filtra per genere se specificato (usando le linee guida ufficiali di Stremio)
     if genre:
         logger.info(f"Filtro canali per genere: {genre}")
-        # Assegniamo il genere a ciascun canale e filtriamo
-        filtered_channels = []
-        for channel in channels:
-            channel_genre = get_channel_genre(channel["name"])
-            if channel_genre == genre:
-                filtered_channels.append(channel)
-        
-        channels = filtered_channels
-        logger.info(f"Trovati {len(channels)} canali per il genere '{genre}'")
-    
-    # Ordina i canali per nome
-    channels = sorted(channels, key=lambda ch: ch["name"])
+    channels = filter_catalog_entries(index, search, genre)
+    logger.info(f"Trovati {len(channels)} canali (ricerca '{search}', genere '{genre}')")
     
     # Applica paginazione
     total_channels = len(channels)
@@ -313,24 +2187,9 @@ def get_catalog_response(type, id, search, skip, genre=""):
     
     logger.info(f"Restituisco {len(channels)} canali (skip={skip}, totale={total_channels})")
     
-    metas = []
-    for channel in channels:
-        # Trova il genere e il logo appropriato per il canale
-        channel_genre = get_channel_genre(channel["name"])
-        logo_url = find_logo_for_channel(channel["name"])
-        
-        metas.append({
-            "id": f"{ID_PREFIX}{channel['id']}",  # Aggiungi il prefisso all'ID
-            "type": "tv",
-            "name": channel["name"],
-            "genres": [channel_genre],
-            "poster": logo_url,  # Usa il logo del canale come poster
-            "posterShape": "square",
-            "background": f"https://via.placeholder.com/1280x720/000080/FFFFFF?text={quote(channel['name'])}",
-            "logo": logo_url  # Usa lo stesso logo come icona del canale
-        })
-    
-    return jsonify({"metas": metas})
+    metas = [build_catalog_meta(entry) for entry in channels]
+    
+    return {"metas": metas}
 
 # Endpoint per i meta (formato standard Stremio)
 @app.route('/meta/<type>/<id>.json', methods=['GET'])
@@ -345,31 +2204,29 @@ def meta(type, id):
     # Rimuoviamo il prefisso per ottenere l'ID originale
     channel_id = id[len(ID_PREFIX):]
     
-    channels = load_italian_channels()
-    channel = next((ch for ch in channels if str(ch["id"]) == channel_id), None)
+    return cached_json_response(("meta", channel_id), lambda index: build_meta_payload(index, channel_id))
+
+def build_meta_payload(index, channel_id):
+    channel = index.by_id.get(channel_id)
     
     if not channel:
         logger.warning(f"Canale con ID {channel_id} non trovato")
-        return jsonify({"meta": None})
-    
-    genre = get_channel_genre(channel["name"])
-    logo_url = find_logo_for_channel(channel["name"])
-    
+        return {"meta": None}
     meta_obj = {
-        "id": f"{ID_PREFIX}{channel['id']}",  # Manteniamo il prefisso nell'ID
+        "id": f"{ID_PREFIX}{channel.id}",  # Manteniamo il prefisso nell'ID
         "type": "tv",
-        "name": channel["name"],
-        "genres": [genre],
-        "poster": logo_url,
+        "name": channel.name,
+        "genres": [channel.genre],
+        "poster": channel.logo,
         "posterShape": "square",
-        "background": f"https://via.placeholder.com/1280x720/000080/FFFFFF?text={quote(channel['name'])}",
-        "logo": logo_url,
-        "description": f"Canale TV italiano: {channel['name']}",
+        "background": f"https://via.placeholder.com/1280x720/000080/FFFFFF?text={quote(channel.name)}",
+        "logo": channel.logo,
+        "description": f"Canale TV italiano: {channel.name}",
         "releaseInfo": "24/7 Live"
     }
     
-    logger.info(f"Meta servito per canale: {channel['name']}")
-    return jsonify({"meta": meta_obj})
+    logger.info(f"Meta servito per canale: {channel.name}")
+    return {"meta": meta_obj}
 
 # Endpoint per lo stream (formato standard Stremio)
 @app.route('/stream/<type>/<id>.json', methods=['GET'])
@@ -390,12 +2247,10 @@ def stream(type, id):
     # Costruisci l'URL del proxy con HTTPS
     base_url = get_base_url()
             
-    headers_str = "&".join([f"header_{quote(k)}={quote(v)}" for k, v in DEFAULT_HEADERS.items()])
-    proxied_url = f"{base_url}/proxy/m3u?url={quote(stream_url)}&{headers_str}"
+    proxied_url = f"{base_url}/proxy/m3u?url={quote(stream_url)}&{HEADER_PROFILE_PARAM}={DEFAULT_HEADER_PROFILE}"
     
-    channels = load_italian_channels()
-    channel = next((ch for ch in channels if str(ch["id"]) == channel_id), None)
-    channel_name = channel["name"] if channel else "Unknown"
+    channel = get_channel_index().by_id.get(channel_id)
+    channel_name = channel.name if channel else "Unknown"
     
     logger.info(f"Stream servito per canale: {channel_name}")
     
@@ -412,11 +2267,537 @@ def stream(type, id):
 
 # Funzione per rilevare il tipo di m3u
 def detect_m3u_type(content):
-    """ Rileva se è un M3U (lista IPTV) o un M3U8 (flusso HLS) """
-    if "#EXTM3U" in content and "#EXTINF" in content:
+    """ Rileva se è un M3U (lista IPTV) o un M3U8 (flusso HLS, anche master playlist senza #EXTINF) """
+    if "#EXTM3U" in content and ("#EXTINF" in content or "#EXT-X-" in content):
         return "m3u8"
     return "m3u"
 
+# Riscrittura HLS: URI dei tag e filtro delle varianti delle master playlist.
+# Limiti del deployment (0 = nessun limite); le richieste possono solo restringerli
+HLS_MAX_BANDWIDTH = int(os.environ.get('HLS_MAX_BANDWIDTH', 0))  # bit/s dichiarati in BANDWIDTH
+HLS_MAX_HEIGHT = int(os.environ.get('HLS_MAX_HEIGHT', 0))  # righe di RESOLUTION (es. 720)
+HLS_SINGLE_VARIANT = os.environ.get('HLS_SINGLE_VARIANT', 'False').lower() == 'true'  # solo la variante migliore ammessa
+# Tag con attributo URI: playlist (verso /proxy/m3u) o risorse come chiavi e segmenti di init (verso /proxy/ts)
+HLS_PLAYLIST_URI_TAGS = ("#EXT-X-MEDIA:", "#EXT-X-I-FRAME-STREAM-INF:", "#EXT-X-RENDITION-REPORT:")
+HLS_RESOURCE_URI_TAGS = ("#EXT-X-KEY:", "#EXT-X-SESSION-KEY:", "#EXT-X-MAP:", "#EXT-X-PART:",
+                         "#EXT-X-PRELOAD-HINT:", "#EXT-X-SESSION-DATA:")
+HLS_URI_ATTRIBUTE_RE = re.compile(r'(?<=[:,])URI="([^"]*)"')
+HLS_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+HLS_GROUP_ATTRIBUTES = ("AUDIO", "VIDEO", "SUBTITLES", "CLOSED-CAPTIONS")
+
+VariantFilter = namedtuple('VariantFilter', ['max_bandwidth', 'max_height', 'single'])
+
+def parse_hls_attributes(line):
+    """ Attributi di un tag HLS (NOME=valore), con le virgolette rimosse """
+    attributes = {}
+    for name, value in HLS_ATTRIBUTE_RE.findall(line.split(":", 1)[1] if ":" in line else ""):
+        attributes[name] = value[1:-1] if value.startswith('"') else value
+    return attributes
+
+def parse_positive_int(value):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(number, 0)
+
+def tighter_limit(limit, requested):
+    """ Il limite più restrittivo tra quello del deployment e quello richiesto (0 = nessun limite) """
+    requested = parse_positive_int(requested)
+    if not limit or not requested:
+        return limit or requested
+    return min(limit, requested)
+
+def resolve_variant_filter(params):
+    """
+    Filtro delle varianti per /proxy/m3u: i limiti HLS_* del deployment, ristretti dai
+    parametri max_bandwidth, max_height e single_variant=1 della richiesta. None se nessun filtro
+    """
+    variant_filter = VariantFilter(
+        max_bandwidth=tighter_limit(HLS_MAX_BANDWIDTH, params.get('max_bandwidth')),
+        max_height=tighter_limit(HLS_MAX_HEIGHT, params.get('max_height')),
+        single=HLS_SINGLE_VARIANT or params.get('single_variant', '') in ('1', 'true')
+    )
+    return variant_filter if any(variant_filter) else None
+
+def variant_lines_to_drop(lines, variant_filter):
+    """
+    Righe da togliere da una master playlist secondo il filtro: varianti oltre i limiti (ne resta
+    sempre almeno una, la più leggera), stream I-frame oltre i limiti o, se resta una sola variante
+    scelta dal filtro, oltre quella variante, e rendition dei gruppi (audio, sottotitoli, ...) non più
+    usati dalle varianti rimaste
+    """
+    variants = []  # (riga del tag, riga dell'URI, attributi)
+    iframes = []
+    pending = None
+    for number, line in enumerate(lines):
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            pending = (number, parse_hls_attributes(line))
+        elif line.startswith("#EXT-X-I-FRAME-STREAM-INF:"):
+            iframes.append((number, parse_hls_attributes(line)))
+        elif pending is not None and line and not line.startswith("#"):
+            variants.append((pending[0], number, pending[1]))
+            pending = None
+    if not variants:
+        return set()
+
+    def bandwidth(attributes):
+        return parse_positive_int(attributes.get("BANDWIDTH"))
+
+    def height(attributes):
+        return parse_positive_int(attributes.get("RESOLUTION", "").rpartition("x")[2])
+
+    def allowed(attributes):
+        if variant_filter.max_bandwidth and bandwidth(attributes) > variant_filter.max_bandwidth:
+            return False
+        return not (variant_filter.max_height and height(attributes) > variant_filter.max_height)
+
+    kept = [variant for variant in variants if allowed(variant[2])]
+    fallback = not kept
+    if fallback:
+        kept = [min(variants, key=lambda variant: bandwidth(variant[2]))]
+    if variant_filter.single:
+        kept = [max(kept, key=lambda variant: bandwidth(variant[2]))]
+
+    def iframe_allowed(attributes):
+        if not allowed(attributes):
+            return False
+        if not (variant_filter.single or fallback):
+            return True
+        # Con una sola variante scelta dal filtro, gli stream I-frame non possono superarla
+        kept_attributes = kept[0][2]
+        if bandwidth(kept_attributes) and bandwidth(attributes) > bandwidth(kept_attributes):
+            return False
+        return not (height(kept_attributes) and height(attributes) > height(kept_attributes))
+
+    dropped = set()
+    for variant in variants:
+        if variant not in kept:
+            dropped.update((variant[0], variant[1]))
+    dropped.update(number for number, attributes in iframes if not iframe_allowed(attributes))
+    groups = {(name, variant[2][name]) for variant in kept for name in HLS_GROUP_ATTRIBUTES if name in variant[2]}
+    for number, line in enumerate(lines):
+        if line.startswith("#EXT-X-MEDIA:"):
+            attributes = parse_hls_attributes(line)
+            if (attributes.get("TYPE"), attributes.get("GROUP-ID")) not in groups:
+                dropped.add(number)
+    return dropped
+
+# Profili di header: ogni insieme di header viene registrato una volta e negli URL
+# riscritti compare solo un token breve firmato (HMAC), valido per tutti i worker del nodo
+HEADER_PROFILE_PARAM = "h"
+HEADER_PROFILES_DIR = os.path.join(SHARED_STATE_DIR, 'header-profiles')
+HEADER_PROFILE_SECRET_PATH = os.path.join(SHARED_STATE_DIR, 'header-profiles.secret')
+HEADER_PROFILE_CACHE_SIZE = 1024  # Profili tenuti in memoria da ogni worker
+HEADER_PROFILE_MAX_PERSISTED = int(os.environ.get('HEADER_PROFILE_MAX_PERSISTED', 10000))  # File su disco per tutto il nodo
+HEADER_PROFILE_MAX_AGE = int(os.environ.get('HEADER_PROFILE_MAX_AGE', 7 * 24 * 3600))  # secondi dall'ultimo utilizzo
+HEADER_PROFILE_PRUNE_INTERVAL = 60  # secondi tra due pulizie della directory da parte dello stesso processo
+HEADER_PROFILE_PRUNE_BATCH = max(HEADER_PROFILE_MAX_PERSISTED // 10, 1)  # nuovi file che anticipano la pulizia
+HEADER_PROFILE_TMP_MAX_AGE = 300  # secondi dopo i quali un file temporaneo è considerato orfano
+HEADER_PROFILE_TOKEN_RE = re.compile(r'^[A-Za-z0-9_-]{16}$')
+
+def load_header_profile_secret():
+    """
+    Chiave per firmare i token: da HEADER_PROFILE_SECRET oppure generata una volta
+    e condivisa dai worker tramite SHARED_STATE_DIR
+    """
+    secret = os.environ.get('HEADER_PROFILE_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    try:
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=SHARED_STATE_DIR, prefix='.secret-', suffix='.tmp')
+        try:
+            os.write(fd, os.urandom(32))
+            os.close(fd)
+            # link() fallisce se un altro worker ha già creato la chiave: in quel caso usiamo la sua
+            os.link(tmp_path, HEADER_PROFILE_SECRET_PATH)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+        with open(HEADER_PROFILE_SECRET_PATH, 'rb') as file:
+            return file.read()
+    except OSError as e:
+        logger.warning(f"Chiave dei profili header non condivisibile, uso una chiave locale: {str(e)}")
+        return os.urandom(32)
+
+HEADER_PROFILE_SECRET = load_header_profile_secret()
+
+header_profiles = OrderedDict()  # token -> header
+header_profiles_lock = threading.Lock()
+header_profiles_written = 0  # file scritti dall'ultima pulizia (protetto da header_profiles_lock)
+header_profiles_pruned_at = 0
+
+def header_profile_token(headers):
+    """Token firmato (16 caratteri) che identifica un insieme di header"""
+    canonical = json.dumps(sorted(headers.items()), ensure_ascii=False, separators=(',', ':'))
+    digest = hmac.new(HEADER_PROFILE_SECRET, canonical.encode('utf-8'), hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(digest).decode('ascii')
+
+def remember_header_profile(token, headers):
+    with header_profiles_lock:
+        header_profiles[token] = MappingProxyType(dict(headers))
+        header_profiles.move_to_end(token)
+        while len(header_profiles) > HEADER_PROFILE_CACHE_SIZE:
+            header_profiles.popitem(last=False)
+
+def touch_header_profile(path):
+    """Aggiorna l'mtime del profilo su disco, usato come momento dell'ultimo utilizzo"""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+def prune_header_profiles():
+    """
+    Limita i profili su disco per tutto il nodo: elimina quelli non usati da HEADER_PROFILE_MAX_AGE
+    secondi e i temporanei orfani e, oltre HEADER_PROFILE_MAX_PERSISTED file, i meno usati di recente
+    """
+    global header_profiles_written, header_profiles_pruned_at
+    with header_profiles_lock:
+        header_profiles_written = 0
+        header_profiles_pruned_at = time.monotonic()
+    now = time.time()
+    entries = []
+    removed = 0
+    try:
+        with os.scandir(HEADER_PROFILES_DIR) as iterator:
+            for entry in iterator:
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if entry.name.startswith('.profile-'):
+                    # I temporanei recenti possono essere scritture in corso di altri worker
+                    expired = now - mtime > HEADER_PROFILE_TMP_MAX_AGE
+                elif entry.name.endswith('.json'):
+                    expired = now - mtime > HEADER_PROFILE_MAX_AGE
+                    if not expired:
+                        entries.append((mtime, entry.path))
+                else:
+                    continue
+                if expired:
+                    try:
+                        os.unlink(entry.path)
+                        removed += 1
+                    except OSError:
+                        pass
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logger.warning(f"Pulizia dei profili header fallita: {str(e)}")
+        return removed
+    if len(entries) > HEADER_PROFILE_MAX_PERSISTED:
+        # Scendiamo al 90% del limite per non ripetere la pulizia a ogni nuovo profilo
+        entries.sort()
+        for _, path in entries[:len(entries) - int(HEADER_PROFILE_MAX_PERSISTED * 0.9)]:
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"Profili header eliminati dal disco: {removed}")
+    return removed
+
+def intern_header_profile(headers):
+    """
+    Registra l'insieme di header e ne restituisce il token (None se non è stato possibile
+    renderlo disponibile agli altri worker)
+    """
+    global header_profiles_written
+    token = header_profile_token(headers)
+    with header_profiles_lock:
+        if token in header_profiles:
+            header_profiles.move_to_end(token)
+            return token
+
+    path = os.path.join(HEADER_PROFILES_DIR, f"{token}.json")
+    if not touch_header_profile(path):
+        try:
+            os.makedirs(HEADER_PROFILES_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=HEADER_PROFILES_DIR, prefix='.profile-', suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(headers, file, ensure_ascii=False)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Impossibile registrare il profilo header {token}: {str(e)}")
+            return None
+        with header_profiles_lock:
+            header_profiles_written += 1
+            needs_prune = (header_profiles_written >= HEADER_PROFILE_PRUNE_BATCH or
+                           time.monotonic() - header_profiles_pruned_at > HEADER_PROFILE_PRUNE_INTERVAL)
+        if needs_prune:
+            prune_header_profiles()
+
+    remember_header_profile(token, headers)
+    return token
+
+def lookup_header_profile(token):
+    """Restituisce gli header del profilo, cercandolo anche tra quelli registrati dagli altri worker"""
+    with header_profiles_lock:
+        headers = header_profiles.get(token)
+        if headers is not None:
+            header_profiles.move_to_end(token)
+            return headers
+
+    if not HEADER_PROFILE_TOKEN_RE.match(token):
+        return None
+    path = os.path.join(HEADER_PROFILES_DIR, f"{token}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            headers = json.load(file)
+    except (OSError, ValueError):
+        return None
+    # Il token deve corrispondere alla firma del contenuto
+    if not isinstance(headers, dict) or not hmac.compare_digest(header_profile_token(headers), token):
+        return None
+    touch_header_profile(path)
+    remember_header_profile(token, headers)
+    return header_profiles.get(token, headers)
+
+# All'avvio (nel master con preload_app) si eliminano i profili vecchi lasciati dalle esecuzioni precedenti
+prune_header_profiles()
+DEFAULT_HEADER_PROFILE = intern_header_profile(DEFAULT_HEADERS) or header_profile_token(DEFAULT_HEADERS)
+remember_header_profile(DEFAULT_HEADER_PROFILE, DEFAULT_HEADERS)
+
+def resolve_proxy_headers(params):
+    """
+    Header upstream e token del profilo dai parametri della richiesta proxy: il profilo
+    indicato da 'h' (o quello di default) più eventuali header_* espliciti
+    """
+    profile = None
+    overrides = {}
+    for key, value in params:
+        if key == HEADER_PROFILE_PARAM:
+            profile = value
+        elif key.lower().startswith("header_"):
+            overrides[unquote(key[7:]).replace("_", "-")] = unquote(value).strip()
+
+    headers = lookup_header_profile(profile) if profile else None
+    if headers is None:
+        if profile:
+            logger.warning(f"Profilo header sconosciuto: {profile}, uso gli header di default")
+        profile = DEFAULT_HEADER_PROFILE
+        headers = DEFAULT_HEADERS
+
+    headers = {**headers, **overrides}
+    if overrides:
+        profile = intern_header_profile(headers)
+    return headers, profile
+
+def upstream_cache_key(url, headers, profile=None):
+    """ Chiave canonica di una risorsa upstream: URL normalizzato e profilo degli header usati """
+    return (normalize_upstream_url(url), profile or tuple(sorted(headers.items())))
+
+def rewrite_m3u8(m3u_content, final_url, headers, profile=None, segment_urls=None, variant_filter=None):
+    """
+    Riscrive gli URL di una playlist M3U8 verso il proxy: segmenti, chiavi, segmenti di init e parti
+    verso /proxy/ts (raccogliendo i segmenti in segment_urls), varianti e rendition verso /proxy/m3u.
+    Con variant_filter le master playlist tengono solo le varianti ammesse
+    """
+    parsed_url = urlparse(final_url)
+    base_url = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path.rsplit('/', 1)[0]}/"
+
+    if profile:
+        headers_query = f"{HEADER_PROFILE_PARAM}={profile}"
+    else:
+        headers_query = "&".join([f"header_{quote(k)}={quote(v)}" for k, v in headers.items()])
+    target_duration = parse_target_duration(m3u_content)
+
+    def proxy_path(route, uri):
+        """ Percorso del proxy per l'URI (None per gli schemi non HTTP, es. chiavi skd:// o data:) """
+        url = urljoin(base_url, uri)
+        if urlparse(url).scheme not in ("http", "https"):
+            return None, url
+        # Manteniamo il path relativo per il proxy
+        return f"/proxy/{route}?url={quote(url)}&{headers_query}", url
+
+    def rewrite_uri_attribute(line, route):
+        return HLS_URI_ATTRIBUTE_RE.sub(lambda match: f'URI="{proxy_path(route, match.group(1))[0] or match.group(1)}"', line)
+
+    lines = [line.strip() for line in m3u_content.splitlines()]
+    dropped = set()
+    if variant_filter and "#EXT-X-STREAM-INF" in m3u_content:
+        dropped = variant_lines_to_drop(lines, variant_filter)
+
+    modified_m3u8 = []
+    variant_uri = False  # la prossima riga URI è una variante della master playlist
+    for number, line in enumerate(lines):
+        if number in dropped:
+            continue
+        if not line or line.startswith("#"):
+            if line.startswith("#EXT-X-STREAM-INF:"):
+                variant_uri = True
+            elif line.startswith(HLS_PLAYLIST_URI_TAGS):
+                line = rewrite_uri_attribute(line, "m3u")
+            elif line.startswith(HLS_RESOURCE_URI_TAGS):
+                line = rewrite_uri_attribute(line, "ts")
+            modified_m3u8.append(line)
+        elif variant_uri:
+            variant_uri = False
+            modified_m3u8.append(proxy_path("m3u", line)[0] or line)
+        else:
+            proxied_url, segment_url = proxy_path("ts", line)
+            if proxied_url is None:
+                modified_m3u8.append(line)
+                continue
+            if target_duration:
+                remember_target_duration(segment_url, target_duration)
+            if segment_urls is not None:
+                segment_urls.append(segment_url)
+            modified_m3u8.append(proxied_url)
+
+    return "\n".join(modified_m3u8), len(modified_m3u8)
+
+def playlist_kind(content):
+    """ Classifica la playlist: master, vod, live oppure m3u (lista IPTV) """
+    if "#EXT-X-STREAM-INF" in content:
+        return "master"
+    if detect_m3u_type(content) == "m3u":
+        return "m3u"
+    if "#EXT-X-ENDLIST" in content or "#EXT-X-PLAYLIST-TYPE:VOD" in content:
+        return "vod"
+    return "live"
+
+def playlist_cache_ttl(kind, content):
+    """ TTL della playlist riscritta: frazione della target duration per le live, più lungo per le altre """
+    if kind == "live":
+        target_duration = parse_target_duration(content)
+        if not target_duration:
+            return PLAYLIST_CACHE_LIVE_DEFAULT_TTL
+        return max(target_duration * PLAYLIST_CACHE_LIVE_FACTOR, 1)
+    if kind == "vod":
+        return PLAYLIST_CACHE_VOD_TTL
+    return PLAYLIST_CACHE_STATIC_TTL
+
+def render_playlist(m3u_bytes, encoding, final_url, headers, profile, segment_urls=None, variant_filter=None):
+    """ Decodifica e riscrive la playlist; restituisce (corpo, content type, TTL in cache) """
+    m3u_content = m3u_bytes.decode(encoding or "utf-8", errors="replace")
+
+    file_type = detect_m3u_type(m3u_content)
+    logger.debug(f"Tipo file m3u rilevato: {file_type}")
+    ttl = playlist_cache_ttl(playlist_kind(m3u_content), m3u_content)
+
+    if file_type == "m3u":
+        return m3u_content.encode("utf-8"), "audio/x-mpegurl", ttl
+
+    modified_m3u8_content, line_count = rewrite_m3u8(m3u_content, final_url, headers, profile, segment_urls, variant_filter)
+    logger.info(f"Proxy m3u: elaborazione completata ({line_count} linee)")
+    return modified_m3u8_content.encode("utf-8"), "application/vnd.apple.mpegurl", ttl
+
+def playlist_completion(cache_key, headers, profile, variant_filter=None):
+    """ Callback di fine download: riscrive la playlist una sola volta e la mette in cache """
+    def store_playlist(fetch):
+        segment_urls = []
+        body, content_type, ttl = render_playlist(b"".join(fetch.chunks), fetch.encoding, fetch.final_url,
+                                                  headers, profile, segment_urls, variant_filter)
+        fetch.result = (body, content_type)
+        playlist_cache.put(cache_key, fetch.result, ttl, size=len(body))
+        # Per le live, i segmenti più recenti saranno richiesti a breve da chi guarda il canale
+        if PREFETCH_ENABLED and segment_urls and playlist_kind(body.decode("utf-8")) == "live":
+            schedule_segment_prefetch(cache_key, segment_urls[-PREFETCH_SEGMENTS:], headers, profile)
+    return store_playlist
+
+def segment_completion(cache_key, ts_url):
+    """
+    Callback di fine download di un segmento: lo conserva in cache se scaricato per intero.
+    La scrittura su disco viene restituita come funzione, eseguita dopo aver svegliato chi attende
+    """
+    def store_segment(fetch):
+        ttl = segment_cache_ttl(ts_url)
+        if fetch.size <= SEGMENT_CACHE_MAX_ENTRY_BYTES:
+            segment_cache.put(cache_key, b"".join(fetch.chunks), ttl)
+        # Il livello su disco conserva più segmenti (e più a lungo) di quanti ne stiano in memoria
+        if segment_disk_cache is not None:
+            return lambda: segment_disk_cache.put(cache_key, fetch.chunks, fetch.size, ttl)
+        return None
+    return store_segment
+
+def get_client_id():
+    """ Identifica lo spettatore (primo indirizzo di X-Forwarded-For o indirizzo remoto) """
+    forwarded_for = request.headers.get('X-Forwarded-For', '')
+    return forwarded_for.split(',')[0].strip() or request.remote_addr or ''
+
+def note_playlist_viewer(playlist_key, client_id):
+    """ Registra una richiesta di playlist per sapere quali canali hanno spettatori attivi """
+    if not PREFETCH_ENABLED:
+        return
+    now = time.monotonic()
+    with prefetch_lock:
+        viewers = playlist_viewers.get(playlist_key)
+        if viewers is None:
+            viewers = playlist_viewers[playlist_key] = {}
+        viewers[client_id] = now
+        playlist_viewers.move_to_end(playlist_key)
+        while len(playlist_viewers) > PREFETCH_MAX_CHANNELS:
+            playlist_viewers.popitem(last=False)
+
+def active_viewers(playlist_key):
+    """ Numero di spettatori distinti che hanno chiesto la playlist nella finestra recente """
+    cutoff = time.monotonic() - PREFETCH_VIEWER_WINDOW
+    with prefetch_lock:
+        viewers = playlist_viewers.get(playlist_key, {})
+        for client_id in [client_id for client_id, seen in viewers.items() if seen < cutoff]:
+            del viewers[client_id]
+        return len(viewers)
+
+def schedule_segment_prefetch(playlist_key, segment_urls, headers, profile):
+    """ Accoda in background il download dei segmenti non ancora in cache """
+    if active_viewers(playlist_key) < PREFETCH_MIN_VIEWERS:
+        count_prefetch("skipped_inactive")
+        return
+    for segment_url in segment_urls:
+        cache_key = upstream_cache_key(segment_url, headers, profile)
+        if segment_cached(cache_key):
+            count_prefetch("skipped_cached")
+            continue
+        with prefetch_lock:
+            # Budget per canale e limite globale di prefetch in attesa
+            if prefetch_inflight.get(playlist_key, 0) >= PREFETCH_CHANNEL_BUDGET or prefetch_pending[0] >= PREFETCH_MAX_PENDING:
+                prefetch_stats["skipped_budget"] += 1
+                continue
+            prefetch_inflight[playlist_key] = prefetch_inflight.get(playlist_key, 0) + 1
+            prefetch_pending[0] += 1
+        count_prefetch("scheduled")
+        get_prefetch_executor().submit(prefetch_segment, playlist_key, segment_url, cache_key, headers)
+
+def prefetch_segment(playlist_key, segment_url, cache_key, headers):
+    """ Scarica un segmento nella cache, agganciandosi a un eventuale download già in corso """
+    try:
+        if segment_cached(cache_key):
+            count_prefetch("skipped_cached")
+            return
+        fetch = get_shared_fetch(("ts",) + cache_key, segment_url, headers, 15,
+                                 on_complete=segment_completion(cache_key, segment_url))
+        fetch.read_all()
+        count_prefetch("completed")
+    except Exception as e:
+        count_prefetch("failed")
+        logger.debug(f"Prefetch fallito per {segment_url}: {str(e)}")
+    finally:
+        with prefetch_lock:
+            prefetch_pending[0] -= 1
+            remaining = prefetch_inflight.get(playlist_key, 1) - 1
+            if remaining > 0:
+                prefetch_inflight[playlist_key] = remaining
+            else:
+                prefetch_inflight.pop(playlist_key, None)
+
+def get_prefetch_executor():
+    """ Pool di thread per il prefetch (uno per processo, ricreato dopo un fork) """
+    global prefetch_executor, prefetch_executor_pid
+    pid = os.getpid()
+    if prefetch_executor is None or prefetch_executor_pid != pid:
+        with prefetch_lock:
+            if prefetch_executor is None or prefetch_executor_pid != pid:
+                prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+                prefetch_executor_pid = pid
+    return prefetch_executor
+
 # Endpoint per il proxy m3u
 @app.route('/proxy/m3u')
 def proxy_m3u():
@@ -427,45 +2808,32 @@ def proxy_m3u():
         return "Errore: Parametro 'url' mancante", 400
 
     # Headers di default per evitare blocchi del server
-    headers = {**DEFAULT_HEADERS, **{
-        unquote(key[7:]).replace("_", "-"): unquote(value).strip()
-        for key, value in request.args.items()
-        if key.lower().startswith("header_")
-    }}
+    headers, profile = resolve_proxy_headers(request.args.items())
+    variant_filter = resolve_variant_filter(request.args)
+
+    # Tutti gli spettatori di un canale (con lo stesso filtro delle varianti) ricevono la stessa playlist riscritta
+    cache_key = upstream_cache_key(m3u_url, headers, profile) + (variant_filter,)
+    note_playlist_viewer(cache_key, get_client_id())
+    cached_playlist = playlist_cache.get(cache_key)
+    if cached_playlist is not None:
+        return Response(cached_playlist[0], content_type=cached_playlist[1])
 
     try:
         logger.info(f"Proxy m3u: richiesta a {m3u_url}")
-        response = requests.get(m3u_url, headers=headers, allow_redirects=True, timeout=30)
-        response.raise_for_status()
-        final_url = response.url  
-        m3u_content = response.text
-
-        file_type = detect_m3u_type(m3u_content)
-        logger.debug(f"Tipo file m3u rilevato: {file_type}")
-
-        if file_type == "m3u":
-            return Response(m3u_content, content_type="audio/x-mpegurl")
-
-        parsed_url = urlparse(final_url)
-        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path.rsplit('/', 1)[0]}/"
-
-        headers_query = "&".join([f"header_{quote(k)}={quote(v)}" for k, v in headers.items()])
-
-        modified_m3u8 = []
-        for line in m3u_content.splitlines():
-            line = line.strip()
-            if line and not line.startswith("#"):
-                segment_url = urljoin(base_url, line)  
-                # Manteniamo il path relativo per il proxy ts
-                proxied_url = f"/proxy/ts?url={quote(segment_url)}&{headers_query}"
-                modified_m3u8.append(proxied_url)
-            else:
-                modified_m3u8.append(line)
-
-        modified_m3u8_content = "\n".join(modified_m3u8)
-        logger.info(f"Proxy m3u: elaborazione completata ({len(modified_m3u8)} linee)")
-        return Response(modified_m3u8_content, content_type="application/vnd.apple.mpegurl")
+        # Le richieste concorrenti per la stessa playlist condividono download e riscrittura
+        fetch = get_shared_fetch(("m3u",) + cache_key, m3u_url, headers, 30,
+                                 on_complete=playlist_completion(cache_key, headers, profile, variant_filter))
+        m3u_bytes = fetch.read_all()
+        if fetch.result is not None:
+            body, content_type = fetch.result
+        else:
+            body, content_type, _ = render_playlist(m3u_bytes, fetch.encoding, fetch.final_url, headers, profile,
+                                                    variant_filter=variant_filter)
+        return Response(body, content_type=content_type)
 
+    except CircuitOpenError as e:
+        logger.warning(f"Download del file M3U/M3U8 rifiutato: {str(e)}")
+        return "Errore: upstream temporaneamente non disponibile", 503, {"Retry-After": str(int(e.retry_after))}
     except requests.Timeout:
         logger.error(f"Timeout durante il download del file M3U/M3U8: {m3u_url}")
         return f"Errore: Timeout durante il download del file M3U/M3U8", 504
@@ -483,17 +2851,39 @@ def proxy_ts():
         return "Errore: Parametro 'url' mancante", 400
 
     # Otteniamo gli headers dalla query string
-    headers = {**DEFAULT_HEADERS, **{
-        unquote(key[7:]).replace("_", "-"): unquote(value).strip()
-        for key, value in request.args.items()
-        if key.lower().startswith("header_")
-    }}
+    headers, profile = resolve_proxy_headers(request.args.items())
+
+    # I segmenti già scaricati vengono serviti direttamente dalla memoria o dal disco
+    cache_key = upstream_cache_key(ts_url, headers, profile)
+    cached_segment = segment_cache.get(cache_key)
+    if cached_segment is not None:
+        response = Response(cached_segment, content_type="video/mp2t", headers={"Accept-Ranges": "bytes"})
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(cached_segment))
+    cached_file = segment_disk_cache.open(cache_key) if segment_disk_cache is not None else None
+    if cached_file is not None:
+        # wsgi.file_wrapper permette a gunicorn di usare sendfile
+        segment_file, size = cached_file
+        response = Response(wrap_file(request.environ, segment_file), content_type="video/mp2t", direct_passthrough=True)
+        response.content_length = size
+        response.headers["Accept-Ranges"] = "bytes"
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
 
     try:
-        response = requests.get(ts_url, headers=headers, stream=True, allow_redirects=True, timeout=15)
-        response.raise_for_status()
-        return Response(response.iter_content(chunk_size=1024), content_type="video/mp2t")
-    
+        # Le richieste concorrenti per lo stesso segmento si agganciano allo stesso download
+        fetch = get_shared_fetch(("ts",) + cache_key, ts_url, headers, 15,
+                                 on_complete=segment_completion(cache_key, ts_url), hedge=True)
+        fetch.wait_headers()
+        response = Response(fetch.iter_chunks(), content_type="video/mp2t")
+        if fetch.content_length is None:
+            return response
+        # Con la dimensione nota il server evita il chunked encoding e il player può riprendere con Range
+        response.content_length = fetch.content_length
+        response.headers["Accept-Ranges"] = "bytes"
+        return response.make_conditional(request, accept_ranges=True, complete_length=fetch.content_length)
+
+    except CircuitOpenError as e:
+        logger.warning(f"Download del segmento TS rifiutato: {str(e)}")
+        return "Errore: upstream temporaneamente non disponibile", 503, {"Retry-After": str(int(e.retry_after))}
     except requests.Timeout:
         logger.error(f"Timeout durante il download del segmento TS: {ts_url}")
         return f"Errore: Timeout durante il download del segmento TS", 504
@@ -547,6 +2937,79 @@ def install_instructions():
     
     return html
 
+def channels_refresh_status():
+    """Freschezza della lista canali e stato dell'ultimo refresh"""
+    state = channels_refresh_state
+    now = time.time()
+    age = now - cache_timestamp if cache_timestamp > 0 else None
+    return {
+        "fresh": age is not None and age < CACHE_DURATION,
+        "refreshing": channels_refresh_lock.locked(),
+        "last_attempt": state["last_attempt"],
+        "last_success": state["last_success"],
+        "last_error": state["last_error"],
+        "last_error_at": state["last_error_at"],
+        "consecutive_failures": state["consecutive_failures"],
+        "next_retry_in_seconds": max(state["retry_at"] - now, 0) if state["retry_at"] else 0
+    }
+
+def warm_up(before_fork=False):
+    """
+    Carica loghi e indice dei canali e serializza le prime pagine del catalogo.
+    Con preload_app gunicorn la esegue nel master prima del fork (before_fork=True): i worker
+    ereditano i dati già pronti e li condividono copy-on-write invece di ricaricarli ciascuno
+    """
+    started = time.perf_counter()
+    load_logos()
+    if not channels_cache:
+        refresh_italian_channels(wait=True)
+    index = channel_index
+    if index is not None:
+        with app.app_context():
+            pages = [("", skip, "") for skip in range(0, WARM_UP_CATALOG_PAGES * 100, 100)]
+            pages += [("", 0, genre) for genre in index.by_genre]
+            for search, skip, genre in pages:
+                cached_json(index, catalog_cache_key(search, skip, genre),
+                            lambda index: build_catalog_payload(index, search, skip, genre))
+    if before_fork:
+        # Ogni worker apre le proprie connessioni upstream: quelle del master non servono più
+        global upstream_session
+        if upstream_session is not None:
+            upstream_session.close()
+            upstream_session = None
+    startup_state["warm_up_pid"] = os.getpid()
+    startup_state["warm_up_seconds"] = round(time.perf_counter() - started, 3)
+    if index is None:
+        logger.warning(f"Warm-up senza canali ({channels_refresh_state['last_error']}): verranno caricati dai worker")
+    else:
+        logger.info(f"Dati pronti in {startup_state['warm_up_seconds']}s: {len(index.entries)} canali, "
+                    f"{response_cache.stats()['entries']} pagine del catalogo in cache")
+
+def startup_status():
+    ready_at = startup_state["ready_at"]
+    return {
+        "started_at": startup_state["started_at"],
+        "ready_at": ready_at,
+        "startup_seconds": round(ready_at - startup_state["started_at"], 3) if ready_at else None,
+        "warm_up_seconds": startup_state["warm_up_seconds"],
+        "preloaded": startup_state["warm_up_pid"] not in (None, os.getpid())
+    }
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness per il bilanciatore: 200 solo quando l'indice dei canali è in memoria.
+    Non avvia caricamenti bloccanti: al più sveglia il refresh in background
+    """
+    ensure_channels_refresher()
+    if channel_index is None or not channel_index.entries:
+        channels_refresher_wakeup.set()
+        response = jsonify({"ready": False, "startup": startup_status()})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    return jsonify({"ready": True, "channels_count": len(channel_index.entries), "startup": startup_status()})
+
 @app.route('/status.json')
 def status():
     """Endpoint per verificare lo stato dell'addon"""
@@ -561,9 +3024,42 @@ def status():
         "channels_cache_age_seconds": time.time() - cache_timestamp if cache_timestamp > 0 else 0,
         "logos_cache_timestamp": CACHE_LOGOS_TIMESTAMP,
         "logos_cache_age_seconds": time.time() - CACHE_LOGOS_TIMESTAMP if CACHE_LOGOS_TIMESTAMP > 0 else 0,
+        "channels_refresh": channels_refresh_status(),
+        "startup": startup_status(),
+        "channels_diff": channels_diff_state,
+        "channels_snapshot": {
+            "path": CHANNELS_SNAPSHOT_PATH,
+            "created_at": channels_snapshot_state["created_at"],
+            "adopted": channels_snapshot_state["adopted"],
+            "written": channels_snapshot_state["written"]
+        },
+        "segment_cache": segment_cache.stats(),
+        "segment_disk_cache": segment_disk_cache.stats() if segment_disk_cache is not None else None,
+        "response_cache": response_cache.stats(),
+        "playlist_cache": playlist_cache.stats(),
+        "prefetch": {"enabled": PREFETCH_ENABLED, **prefetch_stats},
+        "upstream_pools": upstream_pool_stats(),
+        "admission": {
+            "enabled": ADMISSION_ENABLED,
+            "proxy": proxy_admission.stats(),
+            "metadata": metadata_admission.stats()
+        },
+        "upstream_resilience": {
+            "circuit_failure_threshold": CIRCUIT_FAILURE_THRESHOLD,
+            "circuit_open_seconds": CIRCUIT_OPEN_SECONDS,
+            "circuit_breakers": circuit_breaker.stats(),
+            "hedging": hedge_policy.stats()
+        },
         "version": ADDON_VERSION
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metriche in formato Prometheus, sommate su tutti i worker del nodo"""
+    if not METRICS_ENABLED:
+        return "Metriche disattivate", 404
+    return Response(metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route('/<path:invalid_path>')
 def catch_all(invalid_path):
     """Gestisci percorsi non validi reindirizzando alla pagina di installazione"""
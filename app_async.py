@@ -0,0 +1,569 @@
+import asyncio
+import io
+import os
+import sys
+import time
+import logging
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from urllib.parse import unquote_to_bytes, urlparse
+
+import app as addon
+
+logger = logging.getLogger('vavoo-addon')
+
+# Motore asincrono (aiohttp) per /proxy/m3u e /proxy/ts: l'I/O verso l'upstream non blocca thread,
+# quindi un solo processo può servire migliaia di stream. Le altre rotte restano all'app Flask.
+
+# Limite complessivo di connessioni upstream aperte dal processo
+ASYNC_UPSTREAM_LIMIT = int(os.environ.get('ASYNC_UPSTREAM_LIMIT', 1000))
+# Thread usati per eseguire le rotte Flask (catalogo, meta, stream, ...)
+ASYNC_FLASK_THREADS = int(os.environ.get('ASYNC_FLASK_THREADS', 4))
+# Controllo di ammissione delle rotte proxy: stream serviti in contemporanea e coda di attesa
+ASYNC_PROXY_LIMIT = int(os.environ.get('ASYNC_PROXY_LIMIT', ASYNC_UPSTREAM_LIMIT))
+ASYNC_PROXY_QUEUE = int(os.environ.get('ASYNC_PROXY_QUEUE', ASYNC_UPSTREAM_LIMIT))
+
+class AsyncAdmissionLimiter(addon.AdmissionLimiter):
+    """
+    Versione asyncio di addon.AdmissionLimiter: l'attesa in coda non occupa thread
+    """
+    def __init__(self, name, limit, queue_size, queue_timeout):
+        super().__init__(name, limit, queue_size, queue_timeout)
+        self._async_cond = None  # creata nel loop del worker
+
+    def _condition(self):
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+        return self._async_cond
+
+    async def acquire_async(self):
+        cond = self._condition()
+        async with cond:
+            if self.active < self.limit.value and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            try:
+                await asyncio.wait_for(cond.wait_for(lambda: self.active < self.limit.value), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    async def release_async(self):
+        cond = self._condition()
+        async with cond:
+            self.active -= 1
+            cond.notify()
+
+    def observe_latency(self, seconds):
+        # Se il limite cresce le richieste in coda lo vedono al prossimo rilascio o allo scadere dell'attesa
+        self.limit.observe(seconds)
+
+    def stats(self):
+        stats = {
+            "active": self.active,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+        stats.update(self.limit.stats())
+        return stats
+
+proxy_admission = AsyncAdmissionLimiter(
+    "proxy",
+    addon.AdaptiveLimit(ASYNC_PROXY_LIMIT, addon.ADMISSION_ADAPTIVE, addon.ADMISSION_LATENCY_TOLERANCE),
+    ASYNC_PROXY_QUEUE, addon.ADMISSION_QUEUE_TIMEOUT
+)
+
+class AsyncUpstreamFetch:
+    """
+    Download upstream condiviso (versione asyncio di addon.UpstreamFetch)
+    """
+    def __init__(self, key, url, headers, timeout, on_complete=None, hedge=False):
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.on_complete = on_complete  # Può restituire una funzione da eseguire dopo aver svegliato i lettori
+        self.hedge = hedge
+        self.final_url = url
+        self.encoding = None
+        self.content_length = None
+        self.result = None
+        self.chunks = []
+        self.size = 0
+        self.headers_ready = False
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def run(self, session, registry):
+        """Esegue il download in un task dedicato, indipendente dai client"""
+        started = time.perf_counter()
+        ttfb = None
+        host = urlparse(self.url).netloc
+        response = None
+        try:
+            response = await open_upstream(session, self.url, self.headers, self.timeout, self.hedge)
+            async with response:
+                ttfb = time.perf_counter() - started
+                proxy_admission.observe_latency(ttfb)
+                response.raise_for_status()
+                self.final_url = str(response.url)
+                self.encoding = response.charset
+                self.content_length = addon.response_content_length(response.headers)
+                self.headers_ready = True
+                await self._notify()
+                async for chunk in response.content.iter_chunked(addon.UPSTREAM_CHUNK_SIZE):
+                    self.chunks.append(chunk)
+                    self.size += len(chunk)
+                    await self._notify()
+                # Una risposta più corta del Content-Length annunciato è troncata e non va messa in cache
+                if self.content_length is not None and self.size != self.content_length:
+                    raise aiohttp.ClientPayloadError(f"Risposta troncata: ricevuti {self.size} byte su {self.content_length}")
+        except Exception as e:
+            self.error = e
+        if response is not None:
+            # Gli errori 4xx dipendono dalla richiesta, non dalla salute dell'host
+            addon.circuit_breaker.record(host, response.status < 500 and (self.error is None or isinstance(self.error, aiohttp.ClientResponseError)))
+        addon.record_upstream(self.url, ttfb, time.perf_counter() - started, self.size, self.error is None)
+        persist = None
+        try:
+            if self.error is None and self.on_complete:
+                persist = self.on_complete(self)
+        except Exception as e:
+            logger.error(f"Errore nel completamento del download di {self.url}: {str(e)}")
+        self.done = True
+        await self._notify()
+        if persist is not None:
+            # Scrittura su disco e scansione in un thread: non devono bloccare l'event loop
+            await asyncio.get_event_loop().run_in_executor(None, addon.run_persist, persist, self.url)
+        if registry.get(self.key) is self:
+            del registry[self.key]
+
+    async def wait_headers(self):
+        """Attende la risposta upstream; rilancia l'eccezione se la richiesta è fallita"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.headers_ready or self.done)
+        if not self.headers_ready:
+            raise self.error
+
+    async def iter_chunks(self):
+        """Restituisce i chunk già ricevuti e poi quelli in arrivo, fino alla fine del download"""
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.chunks) or self.done)
+            new_chunks = self.chunks[index:]
+            index += len(new_chunks)
+            for chunk in new_chunks:
+                yield chunk
+            if self.done and index >= len(self.chunks):
+                if self.error is not None:
+                    logger.error(f"Download interrotto per {self.url}: {str(self.error)}")
+                return
+
+    async def read_all(self):
+        """Attende la fine del download e restituisce il contenuto completo"""
+        await self.wait_headers()
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return b"".join(self.chunks)
+
+# Etichetta "route" delle metriche per le rotte servite direttamente da aiohttp
+PROXY_ROUTES = {
+    "/proxy/m3u": "proxy_m3u",
+    "/proxy/ts": "proxy_ts"
+}
+
+async def open_upstream(session, url, headers, timeout, hedge=False):
+    """
+    Versione asyncio di addon.open_upstream: circuit breaker per host e, con hedge=True,
+    richiesta duplicata se gli header non arrivano entro il percentile del TTFB
+    """
+    host = urlparse(url).netloc
+    addon.circuit_breaker.before_request(host)
+    delay = addon.hedge_policy.delay(host) if hedge and addon.HEDGE_ENABLED else None
+    if delay is not None:
+        # Il budget si calcola solo sulle richieste per cui una duplicata può davvero partire
+        addon.hedge_policy.start_request()
+    started = time.perf_counter()
+    # Stessa semantica del timeout di requests: connessione e singola lettura, non durata totale
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+    async def get():
+        return await session.get(url, headers=headers, allow_redirects=True, timeout=client_timeout)
+
+    try:
+        primary = asyncio.ensure_future(get())
+        if delay is None:
+            response = await primary
+        else:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not addon.hedge_policy.allow_hedge():
+                response = await primary
+            else:
+                response = await race_hedged_requests(primary, asyncio.ensure_future(get()))
+    except Exception:
+        addon.circuit_breaker.record(host, False)
+        raise
+    if response.status < 500:
+        addon.hedge_policy.observe(host, time.perf_counter() - started)
+    return response
+
+async def race_hedged_requests(primary, hedged):
+    """Restituisce la prima risposta arrivata e annulla l'altra richiesta"""
+    pending = {primary, hedged}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                error = task.exception()
+                continue
+            for loser in pending:
+                loser.cancel()
+                loser.add_done_callback(release_response)
+            if task is hedged:
+                addon.hedge_policy.record_win()
+            return task.result()
+    raise error
+
+def release_response(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().release()
+
+def get_shared_fetch(request, key, url, headers, timeout, on_complete=None, hedge=False):
+    """Restituisce il download in corso per la chiave o ne avvia uno nuovo"""
+    registry = request.app["inflight_fetches"]
+    fetch = registry.get(key)
+    if fetch is None:
+        fetch = AsyncUpstreamFetch(key, url, headers, timeout, on_complete, hedge)
+        registry[key] = fetch
+        fetch.task = asyncio.ensure_future(fetch.run(request.app["upstream_session"], registry))
+    return fetch
+
+def query_items(request):
+    """Parametri della query string con la stessa semantica di request.args.items() di Flask (primo valore)"""
+    items = {}
+    for key, value in request.query.items():
+        items.setdefault(key, value)
+    return items.items()
+
+def client_id(request):
+    """Identifica lo spettatore come addon.get_client_id per le rotte Flask"""
+    forwarded_for = request.headers.get('X-Forwarded-For', '')
+    return forwarded_for.split(',')[0].strip() or request.remote or ''
+
+def requested_range(request, size):
+    """Intervallo (inizio, fine esclusa) richiesto con l'header Range, None se assente o non applicabile"""
+    if "Range" not in request.headers or size == 0:
+        return None
+    try:
+        byte_range = request.http_range
+    except ValueError:
+        byte_range = None
+    start, stop, _ = byte_range.indices(size) if byte_range is not None else (0, 0, 1)
+    if start >= stop:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+    return start, stop
+
+def range_headers(byte_range, size):
+    start, stop = byte_range
+    return {
+        "Content-Type": "video/mp2t",
+        "Accept-Ranges": "bytes",
+        "Content-Range": f"bytes {start}-{stop - 1}/{size}"
+    }
+
+async def skip_range(chunks, start, stop):
+    """Restituisce solo i byte dell'intervallo [start, stop) di uno stream di chunk"""
+    position = 0
+    async for chunk in chunks:
+        chunk_start, position = position, position + len(chunk)
+        if position <= start:
+            continue
+        if chunk_start >= stop:
+            break
+        yield memoryview(chunk)[max(start - chunk_start, 0):min(stop - chunk_start, len(chunk))]
+
+def error_response(text, status):
+    # Flask restituisce le stringhe come text/html
+    return web.Response(text=text, status=status, content_type="text/html")
+
+async def proxy_m3u(request):
+    """ Proxy per file M3U e M3U8 con supporto per redirezioni e header personalizzati """
+    params = dict(query_items(request))
+    m3u_url = params.get('url', '').strip()
+    if not m3u_url:
+        logger.error("Parametro 'url' mancante nella richiesta proxy m3u")
+        return error_response("Errore: Parametro 'url' mancante", 400)
+
+    headers, profile = addon.resolve_proxy_headers(params.items())
+    variant_filter = addon.resolve_variant_filter(params)
+
+    # Cache delle playlist riscritte condivisa con le rotte Flask
+    cache_key = addon.upstream_cache_key(m3u_url, headers, profile) + (variant_filter,)
+    addon.note_playlist_viewer(cache_key, client_id(request))
+    cached_playlist = addon.playlist_cache.get(cache_key)
+    if cached_playlist is not None:
+        return web.Response(body=cached_playlist[0], headers={"Content-Type": cached_playlist[1]})
+
+    try:
+        logger.info(f"Proxy m3u: richiesta a {m3u_url}")
+        fetch = get_shared_fetch(request, ("m3u",) + cache_key, m3u_url, headers, 30,
+                                 on_complete=addon.playlist_completion(cache_key, headers, profile, variant_filter))
+        m3u_bytes = await fetch.read_all()
+        if fetch.result is not None:
+            body, content_type = fetch.result
+        else:
+            body, content_type, _ = addon.render_playlist(m3u_bytes, fetch.encoding, fetch.final_url, headers, profile,
+                                                          variant_filter=variant_filter)
+        return web.Response(body=body, headers={"Content-Type": content_type})
+
+    except addon.CircuitOpenError as e:
+        logger.warning(f"Download del file M3U/M3U8 rifiutato: {str(e)}")
+        response = error_response("Errore: upstream temporaneamente non disponibile", 503)
+        response.headers["Retry-After"] = str(int(e.retry_after))
+        return response
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout durante il download del file M3U/M3U8: {m3u_url}")
+        return error_response("Errore: Timeout durante il download del file M3U/M3U8", 504)
+    except aiohttp.ClientError as e:
+        logger.error(f"Errore durante il download del file M3U/M3U8: {str(e)}")
+        return error_response(f"Errore durante il download del file M3U/M3U8: {str(e)}", 500)
+
+async def proxy_ts(request):
+    """ Proxy per segmenti .TS con headers personalizzati e gestione dei redirect """
+    params = dict(query_items(request))
+    ts_url = params.get('url', '').strip()
+    if not ts_url:
+        logger.error("Parametro 'url' mancante nella richiesta proxy ts")
+        return error_response("Errore: Parametro 'url' mancante", 400)
+
+    headers, profile = addon.resolve_proxy_headers(params.items())
+
+    # La cache dei segmenti è la stessa usata dalle rotte Flask
+    cache_key = addon.upstream_cache_key(ts_url, headers, profile)
+    cached_segment = addon.segment_cache.get(cache_key)
+    if cached_segment is not None:
+        byte_range = requested_range(request, len(cached_segment))
+        if byte_range is not None:
+            return web.Response(body=memoryview(cached_segment)[byte_range[0]:byte_range[1]], status=206,
+                                headers=range_headers(byte_range, len(cached_segment)))
+        return web.Response(body=cached_segment, headers={"Content-Type": "video/mp2t", "Accept-Ranges": "bytes"})
+    if addon.segment_disk_cache is not None:
+        segment_path = await asyncio.get_event_loop().run_in_executor(None, addon.segment_disk_cache.get_path, cache_key)
+        if segment_path is not None:
+            # FileResponse invia il file con sendfile e gestisce da sé le richieste Range
+            return web.FileResponse(segment_path, headers={"Content-Type": "video/mp2t"})
+
+    try:
+        fetch = get_shared_fetch(request, ("ts",) + cache_key, ts_url, headers, 15,
+                                 on_complete=addon.segment_completion(cache_key, ts_url), hedge=True)
+        await fetch.wait_headers()
+    except addon.CircuitOpenError as e:
+        logger.warning(f"Download del segmento TS rifiutato: {str(e)}")
+        response = error_response("Errore: upstream temporaneamente non disponibile", 503)
+        response.headers["Retry-After"] = str(int(e.retry_after))
+        return response
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout durante il download del segmento TS: {ts_url}")
+        return error_response("Errore: Timeout durante il download del segmento TS", 504)
+    except aiohttp.ClientError as e:
+        logger.error(f"Errore durante il download del segmento TS: {str(e)}")
+        return error_response(f"Errore durante il download del segmento TS: {str(e)}", 500)
+
+    chunks = fetch.iter_chunks()
+    if fetch.content_length is None:
+        response = web.StreamResponse(headers={"Content-Type": "video/mp2t"})
+    else:
+        # Con la dimensione nota si evita il chunked encoding e il player può riprendere con Range
+        byte_range = requested_range(request, fetch.content_length)
+        if byte_range is not None:
+            response = web.StreamResponse(status=206, headers=range_headers(byte_range, fetch.content_length))
+            response.content_length = byte_range[1] - byte_range[0]
+            chunks = skip_range(chunks, *byte_range)
+        else:
+            response = web.StreamResponse(headers={"Content-Type": "video/mp2t", "Accept-Ranges": "bytes"})
+            response.content_length = fetch.content_length
+    await response.prepare(request)
+    sent = 0
+    try:
+        async for chunk in chunks:
+            await response.write(chunk)
+            sent += len(chunk)
+        await response.write_eof()
+    finally:
+        # Le risposte in streaming (spesso senza Content-Length) si misurano contando i byte inviati
+        if sent and addon.METRICS_ENABLED:
+            addon.metrics_registry.inc("vavoo_proxied_bytes_total", (("route", "proxy_ts"),), sent)
+    return response
+
+def build_wsgi_environ(request, body):
+    """Costruisce l'environ WSGI equivalente alla richiesta aiohttp"""
+    raw_path, _, query_string = request.raw_path.partition("?")
+    host, _, port = (request.host or "localhost").partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote_to_bytes(raw_path).decode("latin-1"),
+        "QUERY_STRING": query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.scheme == "https" else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace("-", "_")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+        else:
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def call_flask(environ):
+    """Esegue l'app Flask e raccoglie la risposta completa"""
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = status
+        response_start["headers"] = headers
+
+    result = addon.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response_start["status"], response_start["headers"], body
+
+async def flask_fallback(request):
+    """Inoltra all'app Flask tutte le rotte diverse dal proxy"""
+    body = await request.read()
+    environ = build_wsgi_environ(request, body)
+    loop = asyncio.get_event_loop()
+    status, headers, body = await loop.run_in_executor(request.app["flask_executor"], call_flask, environ)
+    response_headers = CIMultiDict()
+    for name, value in headers:
+        if name.lower() not in ("content-length", "transfer-encoding", "connection"):
+            response_headers.add(name, value)
+    return web.Response(body=body, status=int(status.split(" ", 1)[0]), headers=response_headers)
+
+@web.middleware
+async def request_metrics(request, handler):
+    """Metriche delle rotte proxy servite da aiohttp (le altre le registra l'app Flask)"""
+    route = PROXY_ROUTES.get(request.path)
+    if route is None or not addon.METRICS_ENABLED:
+        return await handler(request)
+    labels = (("route", route),)
+    registry = addon.metrics_registry
+    started = time.perf_counter()
+    registry.inc("vavoo_http_requests_in_flight", labels)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        registry.inc("vavoo_http_requests_in_flight", labels, -1)
+        # Le risposte in streaming sono già state inviate per intero quando l'handler termina
+        registry.observe("vavoo_http_request_duration_seconds", labels, time.perf_counter() - started)
+        registry.inc("vavoo_http_requests_total", (("route", route), ("status", str(status))))
+
+@web.middleware
+async def admission_control(request, handler):
+    """Budget di concorrenza delle rotte proxy; le altre passano dal controllo dell'app Flask"""
+    if not addon.ADMISSION_ENABLED or request.path not in PROXY_ROUTES:
+        return await handler(request)
+    if not await proxy_admission.acquire_async():
+        logger.warning(f"Richiesta rifiutata per sovraccarico (proxy): {request.path}")
+        return web.Response(text="Errore: server sovraccarico, riprovare più tardi", status=503,
+                            headers={"Retry-After": str(addon.ADMISSION_RETRY_AFTER)})
+    try:
+        return await handler(request)
+    finally:
+        # Le risposte in streaming sono già state inviate per intero quando l'handler termina
+        await proxy_admission.release_async()
+
+async def add_cors_headers(request, response):
+    # Come Flask-CORS sulle rotte Flask: CORS abilitato per tutti gli endpoint
+    if "Access-Control-Allow-Origin" not in response.headers:
+        response.headers["Access-Control-Allow-Origin"] = "*"
+    route = PROXY_ROUTES.get(request.path)
+    if route is not None and addon.METRICS_ENABLED and type(response) is not web.StreamResponse:
+        # Le risposte non in streaming vengono preparate dopo la fine dell'handler: i byte si contano qui
+        # (quelle in streaming li contano mentre li inviano)
+        body = getattr(response, "body", None)
+        body_length = len(body) if isinstance(body, (bytes, memoryview)) else response.content_length
+        if body_length:
+            addon.metrics_registry.inc("vavoo_proxied_bytes_total", (("route", route),), body_length)
+
+async def on_startup(application):
+    from concurrent.futures import ThreadPoolExecutor
+    if addon.METRICS_ENABLED:
+        addon.metrics_registry.ensure_flusher()
+    connector = aiohttp.TCPConnector(
+        limit=ASYNC_UPSTREAM_LIMIT,
+        limit_per_host=addon.UPSTREAM_POOL_MAXSIZE,
+        force_close=not addon.UPSTREAM_KEEPALIVE
+    )
+    # Come nell'app Flask, i cookie non vengono conservati tra le richieste
+    application["upstream_session"] = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+    application["flask_executor"] = ThreadPoolExecutor(max_workers=ASYNC_FLASK_THREADS, thread_name_prefix="flask")
+
+async def on_cleanup(application):
+    await application["upstream_session"].close()
+    application["flask_executor"].shutdown(wait=False)
+
+async def create_app():
+    """Factory dell'applicazione aiohttp (usata da gunicorn con aiohttp.GunicornWebWorker)"""
+    # /status.json e /metrics riportano il limitatore effettivamente usato dalle rotte proxy
+    addon.proxy_admission = proxy_admission
+    application = web.Application(middlewares=[request_metrics, admission_control])
+    application["inflight_fetches"] = {}
+    application.router.add_get('/proxy/m3u', proxy_m3u)
+    application.router.add_get('/proxy/ts', proxy_ts)
+    application.router.add_route('*', '/{tail:.*}', flask_fallback)
+    application.on_response_prepare.append(add_cors_headers)
+    application.on_startup.append(on_startup)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 10000))
+    logger.info(f"Avvio server asincrono su porta {port}")
+    web.run_app(create_app(), host="0.0.0.0", port=port)
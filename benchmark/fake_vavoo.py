@@ -0,0 +1,187 @@
+"""
+Server locale che imita vavoo.to per i benchmark dell'addon:
+- /channels: lista canali (dimensione e paesi configurabili)
+- /play/<id>/index.m3u8: playlist live con finestra di segmenti che avanza nel tempo
+  (con --variants N: master playlist con N varianti in /play/<id>/v<n>/index.m3u8)
+- /seg/<id>/<sequenza>.ts, /seg/<id>/v<n>/<sequenza>.ts: segmenti TS con latenza ed errori iniettabili
+- /stats: contatori delle richieste ricevute (GET /stats?reset=1 per azzerarli)
+
+Uso: python benchmark/fake_vavoo.py --port 18080 --channels 5000 --segment-latency 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Parole usate per comporre nomi di canale realistici (coprono i generi di generi_canali.json)
+NAME_PREFIXES = ["RAI", "SKY", "CANALE", "RETE", "TELE", "DAZN", "EUROSPORT", "MEDIASET", "DISCOVERY", "NICK"]
+NAME_SUBJECTS = ["SPORT", "CINEMA", "NEWS", "TG", "KIDS", "DOCUMENTARI", "MUSICA", "SERIE", "STORIA", "UNO", "DUE", "ITALIA"]
+COUNTRIES = ["Italy", "Germany", "France", "Spain", "United Kingdom", "Albania", "Turkey", "Portugal"]
+
+class FakeVavoo:
+    """Stato del server finto: configurazione, payload e contatori"""
+    def __init__(self, channels=2000, italy_ratio=0.3, segment_bytes=2 * 1024 * 1024, target_duration=4,
+                 playlist_window=6, playlist_latency=0.0, segment_latency=0.0, channels_latency=0.0,
+                 error_rate=0.0, variants=1, seed=1):
+        self.target_duration = target_duration
+        self.playlist_window = playlist_window
+        self.playlist_latency = playlist_latency
+        self.segment_latency = segment_latency
+        self.channels_latency = channels_latency
+        self.error_rate = error_rate
+        self.variants = variants
+        packet = b"\x47" + bytes(range(187))  # pacchetti TS da 188 byte
+        self.segment = (packet * (segment_bytes // 188 + 1))[:segment_bytes]
+        # Varianti in ordine di qualità: la più alta ha segmenti da segment_bytes, le altre in proporzione
+        self.variant_segments = [self.segment[:segment_bytes * (index + 1) // variants] for index in range(variants)]
+        generator = random.Random(seed)
+        self.channels = []
+        for channel_id in range(channels):
+            country = "Italy" if generator.random() < italy_ratio else generator.choice(COUNTRIES[1:])
+            name = f"{generator.choice(NAME_PREFIXES)} {generator.choice(NAME_SUBJECTS)} {channel_id}"
+            if generator.random() < 0.2:
+                name += " HD"
+            self.channels.append({"id": 100000 + channel_id, "name": name, "country": country})
+        self.channels_body = json.dumps(self.channels).encode("utf-8")
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed + 1)
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def stats(self, reset=False):
+        with self.lock:
+            counts = dict(self.counts)
+            if reset:
+                self.counts.clear()
+        return counts
+
+    def should_fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def master_playlist(self, channel_id):
+        heights = [360, 540, 720, 1080, 1440, 2160]
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for index, segment in enumerate(self.variant_segments):
+            height = heights[min(index, len(heights) - 1)]
+            bandwidth = len(segment) * 8 // self.target_duration
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height}")
+            lines.append(f"v{index}/index.m3u8")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def playlist(self, channel_id, variant=None):
+        # La finestra avanza di un segmento ogni target duration, come una diretta reale
+        last_sequence = int(time.time() // self.target_duration)
+        first_sequence = last_sequence - self.playlist_window + 1
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first_sequence}"
+        ]
+        for sequence in range(first_sequence, last_sequence + 1):
+            lines.append(f"#EXTINF:{self.target_duration:.3f},")
+            lines.append(f"/seg/{channel_id}/{sequence}.ts" if variant is None else f"/seg/{channel_id}/v{variant}/{sequence}.ts")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            path = parsed.path
+            if path == "/stats":
+                reset = parse_qs(parsed.query).get("reset", ["0"])[0] == "1"
+                return self.send_body(200, json.dumps(fake.stats(reset)).encode("utf-8"), "application/json")
+            if path == "/channels":
+                fake.count("channels")
+                time.sleep(fake.channels_latency)
+                return self.send_body(200, fake.channels_body, "application/json")
+            if path.startswith("/play/") and path.endswith(".m3u8"):
+                fake.count("playlist")
+                time.sleep(fake.playlist_latency)
+                if fake.should_fail():
+                    fake.count("playlist_error")
+                    return self.send_body(503, b"errore simulato", "text/plain")
+                parts = path.split("/")
+                channel_id = parts[2]
+                if len(parts) == 5:
+                    body = fake.playlist(channel_id, int(parts[3][1:]))
+                elif fake.variants > 1:
+                    body = fake.master_playlist(channel_id)
+                else:
+                    body = fake.playlist(channel_id)
+                return self.send_body(200, body, "application/vnd.apple.mpegurl")
+            if path.startswith("/seg/") and path.endswith(".ts"):
+                fake.count("segment")
+                time.sleep(fake.segment_latency)
+                if fake.should_fail():
+                    fake.count("segment_error")
+                    return self.send_body(503, b"errore simulato", "text/plain")
+                parts = path.split("/")
+                segment = fake.variant_segments[int(parts[3][1:])] if len(parts) == 5 else fake.segment
+                return self.send_body(200, segment, "video/mp2t")
+            fake.count("not_found")
+            return self.send_body(404, b"not found", "text/plain")
+
+    return Handler
+
+def start(fake, host="127.0.0.1", port=18080):
+    """Avvia il server in un thread e restituisce l'istanza di ThreadingHTTPServer"""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-vavoo", daemon=True).start()
+    return server
+
+def add_arguments(parser):
+    parser.add_argument("--channels", type=int, default=2000, help="numero di canali in /channels")
+    parser.add_argument("--italy-ratio", type=float, default=0.3, help="frazione di canali italiani")
+    parser.add_argument("--segment-bytes", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--target-duration", type=int, default=4, help="secondi per segmento")
+    parser.add_argument("--playlist-window", type=int, default=6, help="segmenti nella playlist live")
+    parser.add_argument("--playlist-latency", type=float, default=0.0, help="secondi di attesa per playlist")
+    parser.add_argument("--segment-latency", type=float, default=0.0, help="secondi di attesa per segmento")
+    parser.add_argument("--channels-latency", type=float, default=0.0, help="secondi di attesa per /channels")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di playlist e segmenti con errore 503")
+    parser.add_argument("--variants", type=int, default=1, help="varianti per canale (>1: master playlist)")
+
+def from_arguments(args):
+    return FakeVavoo(
+        channels=args.channels, italy_ratio=args.italy_ratio, segment_bytes=args.segment_bytes,
+        target_duration=args.target_duration, playlist_window=args.playlist_window,
+        playlist_latency=args.playlist_latency, segment_latency=args.segment_latency,
+        channels_latency=args.channels_latency, error_rate=args.error_rate, variants=args.variants
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upstream finto di vavoo.to per i benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    start(from_arguments(args), args.host, args.port)
+    print(f"Upstream finto in ascolto su http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
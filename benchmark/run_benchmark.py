@@ -0,0 +1,284 @@
+"""
+Benchmark dell'addon contro l'upstream finto (benchmark/fake_vavoo.py), senza toccare vavoo.to.
+
+Avvia l'upstream finto e l'addon con gunicorn (gunicorn_config.py, stesse variabili d'ambiente
+della produzione), esegue gli scenari e riporta throughput, latenze p50/p99 e richieste upstream.
+
+Scenari:
+- catalog: pagine del catalogo e pagine filtrate per genere (errore se una pagina di genere è vuota)
+- search: ricerche nel catalogo
+- meta: meta di canali casuali
+- viewers: N spettatori per canale che seguono la diretta tramite /proxy/m3u e /proxy/ts
+
+Esempi:
+    python benchmark/run_benchmark.py
+    python benchmark/run_benchmark.py --scenarios viewers --viewers-per-channel 20 --watched-channels 5
+    python benchmark/run_benchmark.py --engine async --json risultati.json
+    python benchmark/run_benchmark.py --scenarios viewers --variants 4 --playlist-params max_height=720
+    python benchmark/run_benchmark.py --addon-url http://127.0.0.1:10000 --upstream-port 18080  (addon già avviato)
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import re
+import time
+from urllib.parse import urljoin
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_vavoo  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_QUERIES = ["rai", "sport", "sky cinema", "tg", "kids", "news", "canale 5", "uno", "eurosport", "xyz"]
+
+class Recorder:
+    """Raccoglie latenze, byte ed errori per tipo di richiesta"""
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, kind, seconds, size, ok):
+        with self.lock:
+            self.samples.setdefault(kind, []).append((seconds, size, ok))
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+def summarize(recorder, elapsed):
+    summary = {}
+    for kind, samples in sorted(recorder.samples.items()):
+        latencies = sorted(seconds for seconds, _, _ in samples)
+        total_bytes = sum(size for _, size, _ in samples)
+        summary[kind] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, _, ok in samples if not ok),
+            "requests_per_second": round(len(samples) / elapsed, 1),
+            "megabytes_per_second": round(total_bytes / elapsed / 1e6, 2),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)
+        }
+    return summary
+
+def timed_get(session, recorder, kind, url):
+    """GET con misura della latenza fino all'ultimo byte"""
+    started = time.perf_counter()
+    try:
+        response = session.get(url, timeout=30)
+        body = response.content
+        ok = response.status_code < 400
+    except requests.RequestException:
+        body, ok, response = b"", False, None
+    recorder.add(kind, time.perf_counter() - started, len(body), ok)
+    return response if ok else None
+
+def run_workers(count, deadline, target):
+    threads = [threading.Thread(target=target, args=(worker, deadline), daemon=True) for worker in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def scenario_catalog(args, addon_url, italian_ids, genres, recorder):
+    empty_genres = set()
+
+    def worker(number, deadline):
+        # L'addon legge un solo extra per URL: le pagine per genere e quelle con skip sono richieste distinte
+        session = requests.Session()
+        generator = random.Random(number)
+        while time.time() < deadline:
+            if genres and generator.random() < 0.5:
+                genre = generator.choice(genres)
+                response = timed_get(session, recorder, "genre", f"{addon_url}/catalog/tv/vavoo_italy/genre={genre}.json")
+                if response is not None and not response.json().get("metas"):
+                    empty_genres.add(genre)
+            else:
+                skip = generator.randrange(0, max(len(italian_ids), 1), 100)
+                timed_get(session, recorder, "catalog", f"{addon_url}/catalog/tv/vavoo_italy/skip={skip}.json")
+    run_workers(args.concurrency, time.time() + args.duration, worker)
+    if not genres:
+        raise SystemExit("Nessun genere nel manifest: lo scenario catalog non misurerebbe i filtri per genere")
+    if empty_genres:
+        # Una pagina vuota misura solo il percorso "nessun risultato", non il filtro per genere
+        raise SystemExit(f"Pagine di genere senza canali: {', '.join(sorted(empty_genres))}")
+
+def scenario_search(args, addon_url, italian_ids, genres, recorder):
+    def worker(number, deadline):
+        session = requests.Session()
+        generator = random.Random(number)
+        while time.time() < deadline:
+            query = generator.choice(SEARCH_QUERIES)
+            timed_get(session, recorder, "search", f"{addon_url}/catalog/tv/vavoo_italy/search={query}.json")
+    run_workers(args.concurrency, time.time() + args.duration, worker)
+
+def scenario_meta(args, addon_url, italian_ids, genres, recorder):
+    def worker(number, deadline):
+        session = requests.Session()
+        generator = random.Random(number)
+        while time.time() < deadline:
+            channel_id = generator.choice(italian_ids)
+            timed_get(session, recorder, "meta", f"{addon_url}/meta/tv/vavoo_{channel_id}.json")
+    run_workers(args.concurrency, time.time() + args.duration, worker)
+
+def scenario_viewers(args, addon_url, italian_ids, genres, recorder):
+    watched = italian_ids[:args.watched_channels]
+    target_duration = args.target_duration
+
+    def worker(number, deadline):
+        # Ogni spettatore segue un canale come un player HLS: playlist ogni mezza target duration, segmenti nuovi
+        session = requests.Session()
+        channel_id = watched[number % len(watched)]
+        response = timed_get(session, recorder, "stream", f"{addon_url}/stream/tv/vavoo_{channel_id}.json")
+        if response is None:
+            return
+        playlist_url = response.json()["streams"][0]["url"]
+        playlist_url = addon_url + playlist_url[playlist_url.index("/proxy/"):]
+        if args.playlist_params:
+            playlist_url += "&" + args.playlist_params
+        response = timed_get(session, recorder, "proxy_m3u", playlist_url)
+        if response is not None and "#EXT-X-STREAM-INF" in response.text:
+            # Master playlist: come un player con banda abbondante si segue la variante più alta
+            variants = re.findall(r"BANDWIDTH=(\d+)[^\n]*\n([^\n]+)", response.text)
+            playlist_url = urljoin(playlist_url, max(variants, key=lambda variant: int(variant[0]))[1].strip())
+        seen = set()
+        time.sleep(random.Random(number).random() * target_duration / 2)
+        while time.time() < deadline:
+            started = time.time()
+            response = timed_get(session, recorder, "proxy_m3u", playlist_url)
+            if response is not None:
+                segments = [line.strip() for line in response.text.splitlines() if line.strip() and not line.startswith("#")]
+                # All'avvio un player scarica solo gli ultimi segmenti, poi quelli nuovi
+                new_segments = [segment for segment in segments[-3:] if segment not in seen]
+                for segment in new_segments:
+                    seen.add(segment)
+                    timed_get(session, recorder, "proxy_ts", urljoin(playlist_url, segment))
+            time.sleep(max(target_duration / 2 - (time.time() - started), 0))
+
+    run_workers(len(watched) * args.viewers_per_channel, time.time() + args.duration, worker)
+
+SCENARIOS = {
+    "catalog": scenario_catalog,
+    "search": scenario_search,
+    "meta": scenario_meta,
+    "viewers": scenario_viewers
+}
+
+def start_addon(args, upstream_url, state_dir):
+    """Avvia l'addon con gunicorn puntato all'upstream finto"""
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.addon_port),
+        "VAVOO_API_URL": f"{upstream_url}/channels",
+        "VAVOO_STREAM_BASE_URL": f"{upstream_url}/play/{{id}}/index.m3u8",
+        "SHARED_STATE_DIR": state_dir,
+        "GUNICORN_WORKERS": str(args.workers),
+        "GUNICORN_THREADS": str(args.threads),
+        "SERVER_ENGINE": args.engine
+    })
+    log_file = open(os.path.join(state_dir, "gunicorn.log"), "w")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", "gunicorn_config.py"],
+                               cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    return process
+
+def wait_until_ready(addon_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("L'addon è terminato durante l'avvio (vedi gunicorn.log)")
+        try:
+            if requests.get(f"{addon_url}/status.json", timeout=5).json().get("channels_count", 0) > 0:
+                return
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Addon non pronto entro il timeout")
+
+def print_report(results):
+    header = f"{'scenario':<10} {'richiesta':<10} {'req':>7} {'err':>5} {'req/s':>8} {'MB/s':>8} {'p50 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for scenario, result in results.items():
+        for kind, row in result["requests"].items():
+            print(f"{scenario:<10} {kind:<10} {row['requests']:>7} {row['errors']:>5} {row['requests_per_second']:>8} "
+                  f"{row['megabytes_per_second']:>8} {row['p50_ms']:>9} {row['p99_ms']:>9}")
+        upstream = ", ".join(f"{kind}={count}" for kind, count in sorted(result["upstream"].items())) or "-"
+        print(f"{'':<10} upstream: {upstream}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'addon con upstream vavoo.to simulato")
+    parser.add_argument("--scenarios", default="catalog,search,meta,viewers", help="scenari separati da virgola")
+    parser.add_argument("--duration", type=float, default=15, help="secondi per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="client concorrenti per catalog/search/meta")
+    parser.add_argument("--watched-channels", type=int, default=4, help="canali seguiti nello scenario viewers")
+    parser.add_argument("--viewers-per-channel", type=int, default=10)
+    parser.add_argument("--playlist-params", default="", help="parametri aggiunti a /proxy/m3u (es. max_height=720)")
+    parser.add_argument("--addon-url", help="addon già in esecuzione (altrimenti viene avviato con gunicorn)")
+    parser.add_argument("--addon-port", type=int, default=18100)
+    parser.add_argument("--upstream-port", type=int, default=18080)
+    parser.add_argument("--workers", type=int, default=2, help="worker gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="thread per worker gunicorn")
+    parser.add_argument("--engine", choices=["flask", "async"], default="flask")
+    parser.add_argument("--json", help="file in cui salvare i risultati")
+    fake_vavoo.add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = fake_vavoo.from_arguments(args)
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    process = None
+    if args.addon_url:
+        # Con un addon esterno l'upstream finto deve essere quello a cui l'addon è configurato
+        addon_url = args.addon_url.rstrip("/")
+    else:
+        addon_url = f"http://127.0.0.1:{args.addon_port}"
+    server = fake_vavoo.start(fake, port=args.upstream_port)
+    state_dir = tempfile.mkdtemp(prefix="vavoo-benchmark-")
+
+    try:
+        if not args.addon_url:
+            process = start_addon(args, upstream_url, state_dir)
+        wait_until_ready(addon_url, process)
+        italian_ids = [channel["id"] for channel in fake.channels if channel["country"] == "Italy"]
+        manifest = requests.get(f"{addon_url}/manifest.json", timeout=10).json()
+        genres = []
+        for catalog in manifest.get("catalogs", []):
+            for extra in catalog.get("extra", []):
+                if extra.get("name") == "genre":
+                    # Il manifest dell'addon elenca i generi in catalog["genres"], non nelle opzioni dell'extra
+                    genres = extra.get("options") or catalog.get("genres", [])
+
+        results = {}
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise SystemExit(f"Scenario sconosciuto: {name}")
+            fake.stats(reset=True)
+            recorder = Recorder()
+            started = time.time()
+            SCENARIOS[name](args, addon_url, italian_ids, genres, recorder)
+            elapsed = time.time() - started
+            results[name] = {"seconds": round(elapsed, 2), "requests": summarize(recorder, elapsed), "upstream": fake.stats()}
+
+        print_report(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump({"config": vars(args), "results": results}, file, indent=2)
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,41 @@
+import gc
 import os
+import tempfile
 
 # Configurazione Gunicorn per Render
 workers = int(os.environ.get('GUNICORN_WORKERS', 2))
 threads = int(os.environ.get('GUNICORN_THREADS', 4))
 bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
-worker_class = 'gthread'
 timeout = 120  # Lungo timeout per le richieste proxy
+
+# Motore di esecuzione: "flask" (gthread, default) oppure "async" (aiohttp per gli endpoint proxy)
+SERVER_ENGINE = os.environ.get('SERVER_ENGINE', 'flask').lower()
+
+# L'app viene importata e preparata (canali, loghi, prime pagine del catalogo) nel master prima
+# del fork: i worker partono con i dati pronti e condividono le pagine di memoria copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+if preload_app:
+    # Niente raccolte durante import e warm-up: gli oggetti liberati lascerebbero buchi nelle
+    # pagine che i worker condividono (vedi gc.freeze in on_starting)
+    gc.disable()
+
+if SERVER_ENGINE == 'async':
+    worker_class = 'aiohttp.GunicornWebWorker'
+    wsgi_app = 'app_async:create_app'
+else:
+    worker_class = 'gthread'
+    wsgi_app = 'app:app'
+
+def on_starting(server):
+    # Le metriche dei worker di un'esecuzione precedente non vanno sommate a quelle nuove
+    from metrics import clear_directory
+    shared_state_dir = os.environ.get('SHARED_STATE_DIR', os.path.join(tempfile.gettempdir(), 'vavoo-addon'))
+    clear_directory(os.path.join(shared_state_dir, 'metrics'))
+
+    if preload_app:
+        import app
+        app.warm_up(before_fork=True)
+        # Gli oggetti già creati passano nella generazione permanente: le raccolte dei worker
+        # non li toccano e le loro pagine restano condivise con il master
+        gc.freeze()
+        gc.enable()
@@ -0,0 +1,239 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+
+logger = logging.getLogger('vavoo-addon')
+
+# Metriche in formato Prometheus, aggregate tra i worker gunicorn dello stesso nodo.
+# Ogni thread registra in un proprio shard (nessun lock sul percorso delle richieste);
+# ogni processo scrive periodicamente la somma dei suoi shard in un file, e /metrics
+# somma i file di tutti i worker.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+class MetricsRegistry:
+    """
+    Registro delle metriche del processo: contatori, gauge e istogrammi con etichette
+    """
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._definitions = {}  # nome -> (tipo, descrizione, bucket)
+        self._shared = set()
+        self._collectors = []  # funzioni che restituiscono valori calcolati al momento dell'export
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) di tutti i thread che hanno registrato qualcosa
+        self._retired = {}  # valori dei thread terminati
+        self._shards_lock = threading.Lock()  # solo per registrare nuovi thread e per l'export
+        self._flusher_pid = None
+
+    def define(self, name, kind, description, buckets=LATENCY_BUCKETS, shared=False):
+        """shared: gauge di una risorsa comune ai worker (es. file su disco), aggregato con il massimo"""
+        self._definitions[name] = (kind, description, tuple(buckets) if kind == HISTOGRAM else None)
+        if shared:
+            self._shared.add(name)
+
+    def add_collector(self, collector):
+        """Registra una funzione che restituisce (nome, etichette, valore) al momento dell'export"""
+        self._collectors.append(collector)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """Incrementa un contatore (o un gauge, con amount negativo)"""
+        shard = self._shard()
+        key = (name, labels)
+        value = shard.get(key)
+        if value is None:
+            shard[key] = [amount]
+        else:
+            value[0] += amount
+
+    def observe(self, name, labels, seconds):
+        """Registra un'osservazione in un istogramma"""
+        shard = self._shard()
+        key = (name, labels)
+        value = shard.get(key)
+        buckets = self._definitions[name][2]
+        if value is None:
+            # Conteggi per bucket non cumulativi, poi somma e numero di osservazioni
+            value = shard[key] = [0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if seconds <= bound:
+                value[index] += 1
+                break
+        value[-2] += seconds
+        value[-1] += 1
+
+    def _merge(self, target, source):
+        for key, value in list(source.items()):
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value)
+            else:
+                for index, item in enumerate(value):
+                    current[index] += item
+
+    def collect(self):
+        """Somma gli shard del processo: dizionario (nome, etichette) -> valori"""
+        totals = {}
+        with self._shards_lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # I thread terminati (es. download upstream) confluiscono in un unico shard
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            self._merge(totals, self._retired)
+            for _, shard in alive:
+                self._merge(totals, shard)
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    totals[(name, labels)] = [value]
+            except Exception as e:
+                logger.warning(f"Errore nella raccolta delle metriche: {str(e)}")
+        return totals
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def flush(self):
+        """Scrive in modo atomico i valori del processo nel file condiviso"""
+        series = [[name, list(labels), value] for (name, labels), value in self.collect().items()]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    json.dump({"pid": os.getpid(), "written_at": time.time(), "series": series}, file, separators=(',', ':'))
+                os.replace(tmp_path, self._path(os.getpid()))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Impossibile scrivere le metriche del worker: {str(e)}")
+
+    def flusher_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def ensure_flusher(self):
+        """Avvia il thread di scrittura periodica (uno per processo, anche dopo un fork)"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._shards_lock:
+            if self._flusher_pid != pid:
+                # Dopo un fork gli shard ereditati appartengono al processo padre
+                self._local = threading.local()
+                self._shards = []
+                self._retired = {}
+                threading.Thread(target=self.flusher_loop, name="metrics-flusher", daemon=True).start()
+                self._flusher_pid = pid
+
+    def aggregate(self):
+        """Somma i valori di tutti i worker del nodo; i gauge dei worker terminati vengono ignorati"""
+        self.flush()
+        totals = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for file_name in names:
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name), 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = process_alive(data.get("pid"))
+            for name, labels, value in data.get("series", []):
+                definition = self._definitions.get(name)
+                if definition is None or (definition[0] == GAUGE and not alive):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                current = totals.get(key)
+                if current is None:
+                    totals[key] = list(value)
+                elif name in self._shared:
+                    current[0] = max(current[0], value[0])
+                else:
+                    for index, item in enumerate(value):
+                        current[index] += item
+        return totals
+
+    def render(self):
+        """Esposizione testuale in formato Prometheus (0.0.4)"""
+        totals = self.aggregate()
+        lines = []
+        for name, (kind, description, buckets) in self._definitions.items():
+            series = sorted((labels, value) for (series_name, labels), value in totals.items() if series_name == name)
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind != HISTOGRAM:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-2])}")
+                lines.append(f"{name}_count{format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+def process_alive(pid):
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+def clear_directory(directory):
+    """Elimina i file dei worker di un'esecuzione precedente (da chiamare nel master prima del fork)"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for file_name in names:
+        try:
+            os.unlink(os.path.join(directory, file_name))
+        except OSError:
+            pass
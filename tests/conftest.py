@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# app.py crea al momento dell'import i file condivisi (chiave dei profili header, cache su disco):
+# i test usano una directory temporanea invece di quella di produzione
+os.environ.setdefault("SHARED_STATE_DIR", tempfile.mkdtemp(prefix="vavoo-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
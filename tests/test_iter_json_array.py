@@ -0,0 +1,110 @@
+import json
+import random
+
+import pytest
+
+from app import ChannelRecord, iter_json_array, parse_channel_records
+
+DOCUMENT = json.dumps([
+    {"id": 1, "name": "RAI 1 HD", "country": "Italy"},
+    {"id": 2, "name": "Canale \"5\" \\ tg", "country": "Italy", "tags": ["},{", "]", "\\\""]},
+    {"id": 3, "name": "Télé è ü €", "country": "France", "nested": {"a": {"b": [1, 2.5, -3e2, None, True]}}},
+    {"id": 4, "name": "è📺 emoji", "country": "Italy", "extra": {"x": "},{\"y\":1}"}},
+    12345678901234567890,
+    "stringa con },{ e ]",
+    [],
+    {}
+], ensure_ascii=False).encode("utf-8")
+
+def split_at(data, *positions):
+    bounds = [0] + sorted(positions) + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+def parse(chunks):
+    return list(iter_json_array(chunks))
+
+def test_single_chunk():
+    assert parse([DOCUMENT]) == json.loads(DOCUMENT)
+
+def test_one_byte_chunks():
+    # Tagli dentro stringhe, sequenze di escape, caratteri UTF-8 multibyte e numeri
+    assert parse([DOCUMENT[index:index + 1] for index in range(len(DOCUMENT))]) == json.loads(DOCUMENT)
+
+def test_every_two_chunk_split():
+    expected = json.loads(DOCUMENT)
+    for position in range(len(DOCUMENT) + 1):
+        assert parse(split_at(DOCUMENT, position)) == expected, position
+
+def test_random_three_chunk_splits():
+    expected = json.loads(DOCUMENT)
+    generator = random.Random(1)
+    for _ in range(500):
+        positions = [generator.randrange(len(DOCUMENT) + 1) for _ in range(2)]
+        assert parse(split_at(DOCUMENT, *positions)) == expected, positions
+
+def test_number_split_across_chunks():
+    assert parse([b"[12", b"34", b"5,6", b"7]"]) == [12345, 67]
+    assert parse([b"[1.", b"5e", b"3]"]) == [1500.0]
+
+def test_whitespace_and_empty_chunks():
+    assert parse([b"", b" \n[ ", b"", b"{\"a\" : 1} ", b" , ", b"2\t]", b"  \r\n", b""]) == [{"a": 1}, 2]
+
+def test_empty_array():
+    assert parse([b"[", b"]"]) == []
+    assert parse([b" [ ] "]) == []
+
+def random_value(generator, depth=0):
+    kind = generator.randrange(7 if depth < 3 else 4)
+    if kind == 0:
+        return generator.randrange(-10 ** 6, 10 ** 6)
+    if kind == 1:
+        return generator.choice([None, True, False, 0.5, -1e-3])
+    if kind in (2, 3):
+        return "".join(generator.choice('ab},{[]"\\/è€\n\t ') for _ in range(generator.randrange(8)))
+    if kind in (4, 5):
+        return {f"k{index}": random_value(generator, depth + 1) for index in range(generator.randrange(4))}
+    return [random_value(generator, depth + 1) for _ in range(generator.randrange(4))]
+
+def test_random_documents_match_json_loads():
+    generator = random.Random(2)
+    for _ in range(300):
+        items = [random_value(generator) for _ in range(generator.randrange(6))]
+        data = json.dumps(items, ensure_ascii=generator.random() < 0.5).encode("utf-8")
+        size = generator.randrange(1, 16)
+        assert parse([data[index:index + size] for index in range(0, len(data), size)]) == items, data
+
+@pytest.mark.parametrize("chunks", [
+    [b""],
+    [b"[{\"id\": 1}"],
+    [b"[{\"id\": 1},"],
+    [b"[{\"id\": 1}, {\"id\""],
+    [b"[\"stringa non chiusa"],
+    [b"[12"],
+])
+def test_truncated_input(chunks):
+    with pytest.raises(ValueError):
+        parse(chunks)
+
+@pytest.mark.parametrize("data", [
+    b"{\"id\": 1}",
+    b"[1 2]",
+    b"[1,]",
+    b"[,1]",
+    b"[1] [2]",
+    b"[1] x",
+    b"[{\"id\": }]",
+    b"[tru]",
+])
+def test_invalid_input(data):
+    with pytest.raises(ValueError):
+        parse([data])
+    with pytest.raises(ValueError):
+        parse([data[index:index + 1] for index in range(len(data))])
+
+def test_parse_channel_records_filters_country():
+    chunks = split_at(DOCUMENT, 10, 100, 200)
+    assert parse_channel_records(chunks, "Italy") == [
+        ChannelRecord(id=1, name="RAI 1 HD"),
+        ChannelRecord(id=2, name="Canale \"5\" \\ tg"),
+        ChannelRecord(id=4, name="è📺 emoji")
+    ]
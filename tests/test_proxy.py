@@ -0,0 +1,78 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import app
+
+PLAYLIST_HEAD = b"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:4\n"
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = {}  # percorso -> richieste ricevute
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        UpstreamHandler.hits[self.path] = UpstreamHandler.hits.get(self.path, 0) + 1
+        if self.path.startswith("/stall"):
+            # Invia intestazioni e parte del corpo, poi resta in silenzio oltre il timeout di lettura
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+            self.send_header("Content-Length", "1000")
+            self.end_headers()
+            self.wfile.write(PLAYLIST_HEAD)
+            self.wfile.flush()
+            time.sleep(3)
+            return
+        if self.path.startswith("/short"):
+            # Annuncia 100 byte ma ne invia 10 e chiude la connessione
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", "100")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(b"\x47" * 10)
+            self.close_connection = True
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+@pytest.fixture(scope="module")
+def upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+@pytest.fixture
+def short_timeout(monkeypatch):
+    # Le rotte proxy usano timeout di 15-30 secondi: nei test bastano pochi decimi
+    get_shared_fetch = app.get_shared_fetch
+
+    def shared_fetch(key, url, headers, timeout, *args, **kwargs):
+        return get_shared_fetch(key, url, headers, 0.5, *args, **kwargs)
+
+    monkeypatch.setattr(app, "get_shared_fetch", shared_fetch)
+
+def test_truncated_segment_is_not_cached(upstream):
+    client = app.app.test_client()
+    for _ in range(2):
+        assert len(client.get("/proxy/ts", query_string={"url": f"{upstream}/short/1.ts"}).get_data()) == 10
+    # Il segmento troncato non è stato conservato: la seconda richiesta torna all'upstream
+    assert UpstreamHandler.hits["/short/1.ts"] == 2
+
+def test_read_timeout_mid_body_is_a_requests_timeout(upstream):
+    fetch = app.get_shared_fetch(("test", "stall"), f"{upstream}/stall/fetch.m3u8", {}, 0.5)
+    with pytest.raises(requests.Timeout):
+        fetch.read_all()
+    assert fetch.done
+
+def test_proxy_m3u_returns_504_when_upstream_stalls_mid_body(upstream, short_timeout):
+    response = app.app.test_client().get("/proxy/m3u", query_string={"url": f"{upstream}/stall/route.m3u8"})
+    assert response.status_code == 504